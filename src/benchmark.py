@@ -0,0 +1,220 @@
+"""
+Measures nekoslife-dl against a local stand-in for nekos.life, so it works offline.
+Every benchmark runs once for each thread count, with a fresh save folder.
+Example: `python src/benchmark.py --threads 1 4 16 --cdn-latency 0.05`
+"""
+from nekoslife_dl import NekosLife, NekosLifeScroller
+from nekoslife_dl.mockserver import MockServer
+import argparse
+import json
+import shutil
+import tempfile
+import time
+
+CATEGORY = ('sfw', 'img', 'neko')
+opened = []  # instances made by the running benchmark, closed once it's done
+
+
+def new_nekoslife(server, folder, cls=NekosLife, **kwargs):
+    nekoslife = cls(folder, endpoints_cache=False, retries=args.retries, **kwargs)
+    opened.append(nekoslife)
+    server.patch(nekoslife)
+    server.reset()
+    return nekoslife
+
+
+def close_opened():
+    """
+    Stops the workers and connections of every instance, so they don't slow down the next run.
+    """
+    while opened:
+        nekoslife = opened.pop()
+        getter = getattr(nekoslife, 'get_thread', None)
+        if getter is not None:
+            getter.join() # the scroller still getting urls
+        nekoslife.close()
+
+
+def bench_harvest(server, folder, threads):
+    """
+    Urls gotten per second with `threads` API requests in flight.
+    """
+    nekoslife = new_nekoslife(server, folder, download_threads=0, harvest_threads=threads)
+    start = time.perf_counter()
+    urls = nekoslife.get_multiple_images(*CATEGORY, args.amount, unique=args.amount)
+    seconds = time.perf_counter() - start
+    return {'seconds': seconds, 'urls': len(urls), 'api_requests': server.requests['api'],
+            'urls_per_second': len(urls)/seconds}
+
+
+def bench_download(server, folder, threads):
+    """
+    Images and bytes downloaded per second with `threads` download workers.
+    """
+    nekoslife = new_nekoslife(server, folder, download_threads=threads)
+    urls = [server.image_url(*CATEGORY, i) for i in server.existing_indexes(*CATEGORY)]
+    urls = urls[:args.downloads]
+    start = time.perf_counter()
+    nekoslife.add_to_dlqueue(urls)
+    nekoslife.wait_until_finished(args.timeout)
+    seconds = time.perf_counter() - start
+    size = nekoslife.metrics.counter('nekoslife_downloaded_bytes_total').get()
+    return {'seconds': seconds, 'images': len(urls), 'failed': len(nekoslife.failed_urls),
+            'images_per_second': len(urls)/seconds, 'mib_per_second': size/seconds/2**20}
+
+
+def bench_autocomplete(server, folder, threads):
+    """
+    HEAD requests and time needed to autocomplete a category with `threads` probes at once.
+    """
+    nekoslife = new_nekoslife(server, folder, download_threads=0, probe_threads=threads)
+    urls = nekoslife.get_multiple_images(*CATEGORY, args.amount, unique=args.amount)
+    server.reset()
+    start = time.perf_counter()
+    urls = nekoslife.autocomplete_urls(urls)
+    seconds = time.perf_counter() - start
+    existing = len(server.existing_indexes(*CATEGORY))
+    probes = server.requests['head'] + server.requests['missing']
+    return {'seconds': seconds, 'urls': len(urls), 'existing': existing,
+            'probes': probes, 'hits': server.requests['head']}
+
+
+def bench_scroller(server, folder, threads):
+    """
+    Seconds until the first and every next image can be shown, with `threads` download workers.
+    """
+    nekoslife = new_nekoslife(server, folder, NekosLifeScroller, download_threads=threads)
+    start = time.perf_counter()
+    nekoslife.new_session(CATEGORY)
+    first = time.perf_counter() - start
+
+    times = []
+    for i in range(args.scrolls):
+        nekoslife.get_images_ready(*CATEGORY)
+        start = time.perf_counter()
+        nekoslife.get_next_image()
+        times.append(time.perf_counter() - start)
+    times.sort()
+    return {'first_image': first, 'next_image_mean': sum(times)/len(times),
+            'next_image_p95': times[int(len(times)*0.95)-1], 'next_image_max': times[-1]}
+
+
+BENCHMARKS = {
+    'harvest': bench_harvest,
+    'download': bench_download,
+    'autocomplete': bench_autocomplete,
+    'scroller': bench_scroller,
+}
+
+
+parser = argparse.ArgumentParser('benchmark', description=__doc__)
+parser.add_argument('benchmarks',
+    nargs='*',
+    help="Which benchmarks to run, all by default. One of %s." % ', '.join(BENCHMARKS)
+)
+parser.add_argument('-t','--threads',
+    type=int,
+    nargs='+',
+    default=[1, 2, 4, 8, 16],
+    help="Thread counts every benchmark is run with."
+)
+parser.add_argument('-o','--output',
+    default=None,
+    help="Saves all results as json."
+)
+
+bench = parser.add_argument_group('benchmarks')
+bench.add_argument('-a','--amount',
+    type=int,
+    default=200,
+    help="Amount of urls harvest and autocomplete get from the API."
+)
+bench.add_argument('-d','--downloads',
+    type=int,
+    default=200,
+    help="Amount of images the download benchmark downloads."
+)
+bench.add_argument('--scrolls',
+    type=int,
+    default=50,
+    help="Amount of images the scroller benchmark scrolls through."
+)
+bench.add_argument('--retries',
+    type=int,
+    default=5,
+    help="How many times a failed request is retried."
+)
+bench.add_argument('--timeout',
+    type=int,
+    default=10*60,
+    help="How many seconds the download benchmark waits."
+)
+
+mock = parser.add_argument_group('mock server')
+mock.add_argument('--images',
+    type=int,
+    default=500,
+    help="How many indexes every category has."
+)
+mock.add_argument('--missing-rate',
+    type=float,
+    default=0.05,
+    help="Part of indexes that don't exist."
+)
+mock.add_argument('--size',
+    type=int,
+    nargs='+',
+    default=[0x4000, 0x40000],
+    help="Size of images in bytes, or the smallest and biggest size."
+)
+mock.add_argument('--latency',
+    type=float,
+    default=0.05,
+    help="Seconds added to every API response."
+)
+mock.add_argument('--cdn-latency',
+    type=float,
+    default=0.02,
+    help="Seconds added to every CDN response."
+)
+mock.add_argument('--error-rate',
+    type=float,
+    default=0,
+    help="Part of responses that fail with 500."
+)
+mock.add_argument('--seed',
+    type=int,
+    default=0,
+    help="Same seeds give the same images."
+)
+
+
+args = parser.parse_args()
+benchmarks = args.benchmarks or list(BENCHMARKS)
+for name in benchmarks:
+    if name not in BENCHMARKS:
+        parser.error(f"unknown benchmark {name}, must be one of {', '.join(BENCHMARKS)}")
+size = args.size[0] if len(args.size) == 1 else tuple(args.size[:2])
+
+results = {'settings': vars(args), 'results': {}}
+with MockServer(images=args.images, missing_rate=args.missing_rate, size=size,
+                latency=args.latency, cdn_latency=args.cdn_latency,
+                error_rate=args.error_rate, seed=args.seed) as mock:
+    for name in benchmarks:
+        print(f'[*] {name}')
+        results['results'][name] = {}
+        for threads in args.threads:
+            folder = tempfile.mkdtemp(prefix='nlbench')
+            try:
+                result = BENCHMARKS[name](mock, folder, threads)
+            finally:
+                close_opened()
+                shutil.rmtree(folder, ignore_errors=True)
+            results['results'][name][threads] = result
+            print(f'    {threads:>3} threads  ' + '  '.join(
+                f'{k}={v:.3f}' if isinstance(v, float) else f'{k}={v}'
+                for k, v in result.items()))
+
+if args.output is not None:
+    with open(args.output, 'w') as file:
+        json.dump(results, file, indent=4)
@@ -1,5 +1,8 @@
-from nekoslife_dl import NekosLife
+from nekoslife_dl import NekosLife, JobRunner, load_jobs, SQLiteQueue, Shard, Checkpoint
+from nekoslife_dl.launcher import launch, strip_option
 import argparse
+import os
+import sys
 import time
 __doc__ = """
 Downloads images from https://nekos.life.
@@ -7,9 +10,15 @@ Has a progress bar and multi-threaded download.
 """
 parser = argparse.ArgumentParser('nekoslife-dl',description=__doc__)
 
-parser.add_argument('type',choices=NekosLife.ENDPOINT_TYPES)
-parser.add_argument('format',choices=NekosLife.ENDPOINT_FORMATS)
-parser.add_argument('category')
+parser.add_argument('type',nargs='?',choices=NekosLife.ENDPOINT_TYPES)
+parser.add_argument('format',nargs='?',choices=NekosLife.ENDPOINT_FORMATS)
+parser.add_argument('category',nargs='?')
+parser.add_argument('-j','--jobs',
+    default=None,
+    help="Json file of categories to download in one go, instead of type, format and category. \
+          Categories can be globs and have their own amount, unique, expected and autocomplete, \
+          the arguments are used for the ones they don't set. See README."
+)
 parser.add_argument('-q','--quiet',
     action='store_true',
     help="Does not show the progress bar."
@@ -34,7 +43,7 @@ download.add_argument('--timeout',
 )
 download.add_argument('-c','--autocomplete','--complete',
     action='store_true',
-    help="Autocompletes the missing images. Fairly slow since it has to test multiple urls."
+    help="Autocompletes the missing images. Has to test multiple urls, see --probe-threads."
 )
 download.add_argument('-e','--expected','--use-expected-unique',
     type=int,
@@ -51,7 +60,55 @@ paths.add_argument('-f','--folder',
 paths.add_argument('-F','--url-file',
     default=None,
     help="Uses a file to store all gotten urls. Can later read from it to save time.\
-          They will be added only after url collecting ends."
+          They will be added only after url collecting ends. \
+          Files ending with .db, .sqlite or .sqlite3 are indexed url stores, \
+          use `python src/nekoslife_dl/urlstore.py` to convert plain text files."
+)
+paths.add_argument('-S','--scheme-file',
+    default=None,
+    help="Saves how the filenames of each category look, so autocomplete needs less requests."
+)
+paths.add_argument('-H','--hash-index',
+    default=None,
+    help="Database of the content hashes of downloaded images, used to find duplicates."
+)
+paths.add_argument('--duplicates',
+    choices=('record','skip','hardlink'),
+    default='record',
+    help="What to do with an image that has the same content as another one, needs --hash-index. \
+          record only remembers it, skip deletes it and hardlink replaces it with a hardlink."
+)
+paths.add_argument('--queue',
+    default=None,
+    help="Shares the download queue with other processes through this sqlite file, \
+          on a shared filesystem it can be used by several machines. See --shard."
+)
+paths.add_argument('--metrics-file',
+    default=None,
+    help="Saves request, download and queue metrics every 10 seconds and at the end. \
+          Files ending with .prom use the prometheus text format, others are json."
+)
+paths.add_argument('--thumbnails',
+    type=int,
+    nargs='+',
+    default=None,
+    metavar='SIZE',
+    help="Makes thumbnails that fit into SIZExSIZE of every downloaded image, \
+          in a folder next to --folder called FOLDER.thumbnails. Needs pillow."
+)
+paths.add_argument('--checkpoint',
+    default=None,
+    help="Saves which urls were gotten, how far autocomplete got and the download queue \
+          every 30 seconds and when interrupted. Deleted once everything is downloaded. \
+          With --shard, every part gets its own file ending with .K"
+)
+paths.add_argument('--resume',
+    action='store_true',
+    help="Continues from --checkpoint, without asking the API or checking indexes again."
+)
+paths.add_argument('--endpoints-cache',
+    default=None,
+    help="Where the list of categories is cached, ~/.cache/nekoslife-dl/endpoints.json by default."
 )
 
 utility = parser.add_argument_group('utility')
@@ -60,40 +117,192 @@ utility.add_argument('--threads',
     default=1,
     help="How many threads will be used to download images."
 )
+utility.add_argument('--max-threads',
+    type=int,
+    default=None,
+    help="Changes the amount of download threads automatically, between 1 and this, \
+          starting at --threads. More are added while they make downloads faster, \
+          and removed when downloads fail or there's nothing to download."
+)
+utility.add_argument('--harvest-threads',
+    type=int,
+    default=1,
+    help="How many API requests will be kept in flight while getting urls."
+)
+utility.add_argument('--probe-threads',
+    type=int,
+    default=8,
+    help="How many urls will be checked at once while autocompleting."
+)
+utility.add_argument('--rate-limit',
+    type=float,
+    default=None,
+    help="Maximum requests per second sent to each host, slows down further when throttled."
+)
+utility.add_argument('--retries',
+    type=int,
+    default=5,
+    help="How many times a failed request is retried, with exponential backoff."
+)
+utility.add_argument('--asyncio',
+    action='store_true',
+    help="Uses the asyncio engine instead of threads, requires aiohttp."
+)
+utility.add_argument('--concurrency',
+    type=int,
+    default=100,
+    help="How many requests can be in flight at once with --asyncio."
+)
+utility.add_argument('--processes',
+    type=int,
+    default=1,
+    help="Runs this many processes that share the work, uses --queue or FOLDER.queue.db."
+)
+utility.add_argument('--shard',
+    type=Shard.parse,
+    default=Shard(),
+    metavar='K/N',
+    help="Only does part K of N of the work, with --jobs every Nth category, \
+          otherwise a part of the amount and of the autocompleted indexes. \
+          Run every part on a different process or machine with the same --queue."
+)
+utility.add_argument('--refresh-endpoints',
+    action='store_true',
+    help="Gets the list of categories again, even if it's cached."
+)
 utility.add_argument('--sort-url-file',
     action='store_true',
     help="Sorts urls in the url file. No functionality."
 )
 utility.add_argument('--update-file-every-url',
     action='store_true',
-    help="Adds a url every autocomplete, causes performance issues."
+    help="Adds a url every autocomplete, causes performance issues with plain text url files."
 )
 
 
 args = parser.parse_args()
 
+if args.jobs is None and args.category is None:
+    parser.error("either type, format and category or --jobs is required")
+if args.jobs is not None and args.asyncio:
+    parser.error("--jobs can't be used with --asyncio")
+
+if args.processes > 1:
+    if args.shard.count > 1:
+        parser.error("--processes can't be used with --shard")
+    if args.asyncio:
+        parser.error("--processes can't be used with --asyncio")
+    queue = args.queue or os.path.normpath(args.folder)+'.queue.db'
+    argv = strip_option(sys.argv[1:], '--processes', '--queue')
+    # only the first process shows a progress bar
+    sys.exit(launch(sys.argv[0], argv, args.processes,
+        lambda i: ['--queue', queue, *(['--quiet'] if i else [])]))
+
+if args.queue is not None and args.asyncio:
+    parser.error("--queue can't be used with --asyncio")
+if args.shard.count > 1 and args.asyncio:
+    parser.error("--shard can't be used with --asyncio")
+if args.thumbnails is not None and args.asyncio:
+    parser.error("--thumbnails can't be used with --asyncio")
+if args.checkpoint is not None and args.asyncio:
+    parser.error("--checkpoint can't be used with --asyncio")
+if args.asyncio:
+    # the asyncio engine has its own concurrency and doesn't learn schemes or hash downloads
+    for option in ('scheme_file', 'hash_index', 'duplicates',
+                   'harvest_threads', 'probe_threads', 'max_threads'):
+        if getattr(args, option) != parser.get_default(option):
+            parser.error(f"--{option.replace('_', '-')} can't be used with --asyncio")
+if args.resume and args.checkpoint is None:
+    parser.error("--resume needs --checkpoint")
+
+checkpoint = None
+if args.checkpoint is not None:
+    path = args.checkpoint
+    if args.shard.count > 1:
+        path += f'.{args.shard.index}'
+    checkpoint = Checkpoint(path, resume=args.resume)
+
 if args.expected is not None:
     args.unique = 0xffffffff
 
-nekoslife = NekosLife(
-    args.folder, download_threads = args.threads, 
-    progress_bar = not args.quiet,
-    url_file = args.url_file, sort_url_file = args.sort_url_file)
-nekoslife.raise_for_category(args.type,args.format,args.category)
-
-urls = nekoslife.get_multiple_images(
-    args.type,args.format,args.category,
-    amount = args.amount,
-    add_to_dlqueue = True,
-    use_url_file = args.url_file is not None,
-    unique = args.unique,
-    use_expected_unique = args.expected is not None,
-    expected_unique_leeway = args.expected)
-
-if args.autocomplete:
-    nekoslife.autocomplete_urls(urls,
-        add_to_dlqueue=True,
-        use_url_file=args.url_file is not None,
-        update_file_every_url=args.update_file_every_url)
-
-nekoslife.wait_until_finished(args.timeout)
\ No newline at end of file
+if args.asyncio:
+    from nekoslife_dl import BlockingNekosLife
+    nekoslife = BlockingNekosLife(
+        args.folder, concurrency = args.concurrency,
+        progress_bar = not args.quiet,
+        url_file = args.url_file, sort_url_file = args.sort_url_file,
+        rate_limit = args.rate_limit, retries = args.retries,
+        endpoints_cache = args.endpoints_cache)
+else:
+    nekoslife = NekosLife(
+        args.folder, download_threads = args.threads, max_download_threads = args.max_threads,
+        progress_bar = not args.quiet,
+        url_file = args.url_file, sort_url_file = args.sort_url_file,
+        harvest_threads = args.harvest_threads, probe_threads = args.probe_threads,
+        scheme_file = args.scheme_file,
+        hash_index = args.hash_index, duplicates = args.duplicates,
+        rate_limit = args.rate_limit, retries = args.retries,
+        endpoints_cache = args.endpoints_cache,
+        dlqueue = args.queue and SQLiteQueue(args.queue),
+        thumbnail_sizes = args.thumbnails,
+        checkpoint = checkpoint)
+if args.metrics_file is not None:
+    nekoslife.metrics.save_every(args.metrics_file)
+if checkpoint is not None:
+    checkpoint.save_every(30)
+
+try:
+    endpoints = nekoslife.get_endpoints(force=args.refresh_endpoints)
+    if args.jobs is not None:
+        jobs = load_jobs(args.jobs, endpoints, defaults={
+            'amount': args.amount, 'unique': 0 if args.expected is not None else args.unique,
+            'expected': args.expected, 'autocomplete': args.autocomplete})
+        jobs = args.shard.select(jobs)
+        runner = JobRunner(nekoslife, jobs,
+            use_url_file = args.url_file is not None,
+            update_file_every_url = args.update_file_every_url)
+        finished = runner.run(args.timeout)
+    else:
+        nekoslife.raise_for_category(args.type,args.format,args.category,endpoints)
+
+        urls = nekoslife.get_multiple_images(
+            args.type,args.format,args.category,
+            amount = args.shard.split(args.amount),
+            add_to_dlqueue = True,
+            use_url_file = args.url_file is not None,
+            unique = args.unique if args.expected is not None else args.shard.split(args.unique),
+            use_expected_unique = args.expected is not None,
+            expected_unique_leeway = args.expected)
+
+        if args.autocomplete:
+            # the asyncio engine can't shard, --shard is rejected with it
+            sharding = {} if args.asyncio else {'shard': args.shard}
+            nekoslife.autocomplete_urls(urls,
+                add_to_dlqueue=True,
+                use_url_file=args.url_file is not None,
+                update_file_every_url=args.update_file_every_url,
+                **sharding)
+
+        finished = nekoslife.wait_until_finished(args.timeout)
+except BaseException:
+    if checkpoint is not None:
+        checkpoint.save()
+        print(f'\n[*] checkpoint saved to {checkpoint.path}, continue with --resume')
+    raise
+finally:
+    if args.asyncio:
+        # stops the event loop, NekosLife's daemon workers just end with the process
+        nekoslife.close()
+
+if checkpoint is not None:
+    if finished and not nekoslife.failed_urls:
+        checkpoint.remove()
+    else:
+        checkpoint.save()
+
+if args.metrics_file is not None:
+    nekoslife.metrics.save(args.metrics_file)
+if nekoslife.failed_urls and not args.quiet:
+    print(f'\n[!] {len(nekoslife.failed_urls)} images failed to download')
+if nekoslife.hash_index is not None and not args.quiet:
+    print(f'\n[*] {len(nekoslife.hash_index.get_duplicates())} duplicates in total')
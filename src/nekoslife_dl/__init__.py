@@ -1,2 +1,14 @@
 from .nekoslife import NekosLife
-from .scroller import NekosLifeScroller
\ No newline at end of file
+from .scroller import NekosLifeScroller
+from .urlstore import URLStore
+from .hashindex import HashIndex
+from .jobs import Job, JobRunner, load_jobs
+from .queues import SQLiteQueue
+from .launcher import Shard
+from .metrics import Metrics
+from .thumbnails import ThumbnailCache
+from .checkpoint import Checkpoint
+try:
+    from .asyncnekoslife import AsyncNekosLife, BlockingNekosLife
+except ImportError:
+    pass # aiohttp is only needed for the asyncio engine
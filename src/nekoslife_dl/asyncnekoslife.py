@@ -0,0 +1,523 @@
+"""
+The asyncio nekoslife file
+Contains AsyncNekosLife and BlockingNekosLife, its synchronous wrapper
+"""
+import asyncio
+import os
+import threading
+import time
+from urllib.parse import urlsplit
+import aiohttp
+import requests
+from .nekoslife import NekosLife
+from .scheduler import RequestScheduler
+
+
+class AsyncRequestScheduler(RequestScheduler):
+    """
+    Same as `RequestScheduler`, but sends requests through an `aiohttp.ClientSession` \
+    and waits with `asyncio.sleep`, so the event loop never blocks.
+    """
+    async def request(self, method, url, **kwargs):
+        """
+        Sends a request, retrying it when it fails.
+        Returns the last response if all retries failed with a bad status,
+        raises the last exception if they failed with a connection error.
+        Use the response with `async with`, so its connection is released.
+        """
+        bucket, breaker = self.get_host(urlsplit(url).netloc)
+
+        for attempt in range(self.retries + 1):
+            while True:
+                wait = breaker.remaining() or bucket.reserve()
+                if not wait:
+                    break
+                await asyncio.sleep(wait)
+            try:
+                r = await self.session.request(method, url, **kwargs)
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+                delay = self.on_error(url, attempt, e)
+                if delay is None:
+                    raise
+            else:
+                delay = self.on_response(url, attempt, r.status, r)
+                if delay is None:
+                    return r
+                r.release()
+            await asyncio.sleep(delay)
+
+
+class AsyncNekosLife(NekosLife):
+    """
+    Same as NekosLife, but everything runs as coroutines in a single thread.
+    API batches, downloads and HEAD probes all share a `concurrency` limit,
+    so you can have hundreds of downloads in flight without hundreds of threads.
+
+    The session and download workers only exist inside a running event loop
+    ```
+    from nekoslife_dl import AsyncNekosLife
+    async with AsyncNekosLife(...) as nekoslife:
+        await nekoslife.get_multiple_images(...,add_to_dlqueue=True)
+        await nekoslife.wait_until_finished()
+    ```
+    If you're not in an event loop, use `BlockingNekosLife`.
+    """
+
+    CONCURRENCY = 100
+    HARVEST_CONCURRENCY = 8  # API batches in flight, more means more overshoot
+
+    def __init__(self,
+        save_folder: str = 'images', concurrency: int = 100,
+        progress_bar: bool = False,
+        url_file: str = None, sort_url_file: bool = False,
+        timeout=None, rate_limit: float = None, retries: int = 5,
+        endpoints_cache=None):
+        """
+        `concurrency` is the maximum amount of requests in flight at once.
+        Everything else is the same as in `NekosLife`, \
+        requests are rate limited and retried by an `AsyncRequestScheduler`.
+        """
+        self.CONCURRENCY = concurrency
+        super().__init__(save_folder, download_threads=0,
+            progress_bar=progress_bar,
+            url_file=url_file, sort_url_file=sort_url_file,
+            timeout=timeout, rate_limit=rate_limit, retries=retries,
+            endpoints_cache=endpoints_cache)
+        self.dlqueue = None # made in the event loop by `open`
+
+    async def __aenter__(self):
+        await self.open()
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    async def open(self):
+        """
+        Creates the session and starts the download workers.
+        Must be called inside the event loop that will be used.
+        """
+        self.session = self.scheduler.session = self.create_session(self.CONCURRENCY)
+        self.dlqueue = asyncio.Queue()
+        self._semaphore = asyncio.Semaphore(self.CONCURRENCY)
+        self._start_download_workers(self.CONCURRENCY)
+
+    async def close(self):
+        """
+        Stops the download workers and closes all connections.
+        """
+        for worker in self._download_workers:
+            worker.cancel()
+        await asyncio.gather(*self._download_workers, return_exceptions=True)
+        self._download_workers = []
+        if self.session is not None:
+            await self.session.close()
+
+    # =========================================================================
+    # get images
+
+    async def get_images(self, imgtype: str, imgformat: str, imgcategory: str, amount: int = None):
+        """
+        Gets images from nekos.life, look at `get_endpoints()` to see all endpoints.
+        Size of list is `amount`, `MAX_IMAGE_COUNT` by default.
+        Raises `requests.HTTPError` if the status code is not 200, like `NekosLife.get_images`.
+        """
+        if amount == 0:
+            amount = self.MAX_IMAGE_COUNT
+
+        url = self.generate_image_url(imgtype, imgformat, imgcategory, amount)
+        with self.metrics.histogram('nekoslife_api_seconds', 'API request latency').time():
+            status, data = await self.request('GET', url)
+        if status != 200:
+            raise requests.HTTPError(f'{status} Error for url: {url}')
+
+        data = data['data']
+        if not data['status']['success']:
+            raise ValueError(
+                'You must supply a proper category, check endpoints.')
+        urls = data['response']['urls']
+
+        return urls
+
+    async def get_multiple_images(self,
+            imgtype: str, imgformat: str, imgcategory: str, amount: int,
+            add_to_dlqueue: bool = False,
+            use_url_file=False,
+            unique: int = 0, use_expected_unique: bool = False,
+            expected_unique_leeway: int = 0):
+        """
+        Same as `NekosLife.get_multiple_images`,
+        but keeps `HARVEST_CONCURRENCY` API requests in flight.
+        May overshoot `unique` by the batches that were in flight when it was reached.
+        """
+        urls, expected_unique = self._start_getting(use_url_file, add_to_dlqueue, unique,
+            category=f'{imgtype}/{imgformat}/{imgcategory}')
+
+        amounts = iter(self._number_split(amount, self.MAX_IMAGE_COUNT))
+        pending = set()
+        finished = False
+        while not finished:
+            for i in amounts:
+                pending.add(asyncio.ensure_future(
+                    self.get_images(imgtype, imgformat, imgcategory, i)))
+                if len(pending) >= self.HARVEST_CONCURRENCY:
+                    break
+            if not pending:
+                break
+
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                new_urls = self._add_new_urls(urls, task.result(), unique)
+
+                if add_to_dlqueue:
+                    self.add_to_dlqueue(new_urls)
+                self.print_progress_bar()
+
+                expected_unique = self.get_expected_unique(new_urls,expected_unique)
+
+                if self._finished_getting(urls, unique,
+                        use_expected_unique, expected_unique, expected_unique_leeway):
+                    finished = True
+                    break
+
+        for task in pending:
+            task.cancel()
+
+        if use_url_file:
+            self.add_urls_file(set(urls))
+
+        return urls
+
+    # =========================================================================
+    # download
+
+    def add_to_dlqueue(self, urls):
+        """
+        Adds urls to `dlqueue`.
+        Uses methods `should_enqueue(url_to_imagedata(url))` to check url validity.
+        """
+        for url in urls:
+            urldata = self.url_to_imagedata(url)
+            if self.should_enqueue(*urldata):
+                self.dlqueue.put_nowait(urldata)
+
+    async def wait_until_finished(self, timeout=60*60):
+        """
+        Waits until all downloads are finished.
+        Returns True when everything was downloaded.
+        """
+        try:
+            await asyncio.wait_for(self.dlqueue.join(), timeout)
+        except asyncio.TimeoutError:
+            return False
+        return True
+
+    # =========================================================================
+    # autocomplete
+
+    async def check_real_url(self,url) -> bool:
+        """
+        Checks if the status code is 200.
+        """
+        status, _ = await self.request('HEAD', url)
+        return status == 200
+
+    async def check_file_extensions(self,url_format,index,zeros):
+        """
+        Goes through possible img file extensions, returns the real one.
+        Returns None if none is real.
+        """
+        for check in self._extension_candidates(url_format,index,zeros):
+            if await self.check_real_url(check):
+                return check
+        return None
+
+    async def autocomplete_urls(self,
+            urls,
+            sort=True,check_over=True,
+            add_to_dlqueue=False,
+            use_url_file=False,update_file_every_url=False):
+        """
+        Same as `NekosLife.autocomplete_urls`, but checks all missing indexes at once.
+        Indexes that don't exist are skipped instead of stopping the autocomplete.
+        `check_over` checks `CONCURRENCY` indexes over the max at a time, until one is missing.
+        """
+        if sort:
+            urls = sorted(set(urls), key=self.url_index)
+        urls = [url for url in urls if self.matches_regex(url)]
+        if not urls:
+            return urls
+
+        image_amount = self.url_index(urls[-1])
+        if image_amount == 0:
+            return urls
+
+        zeros = sum(i.isdigit() for i in os.path.split(urls[0])[1])
+
+        def found(url):
+            if add_to_dlqueue:
+                self.add_to_dlqueue([url])
+            if update_file_every_url:
+                self.add_urls_file([url])
+            urls.append(url)
+
+        known = {self.url_index(url) for url in urls}
+        missing = [i for i in range(1, image_amount+1) if i not in known]
+        checked = await asyncio.gather(*(
+            self.check_file_extensions(urls[0],i,zeros) for i in missing))
+        for url in checked:
+            if url is not None:
+                found(url)
+
+        # check for more over the max
+        index = image_amount+1
+        while check_over:
+            checked = await asyncio.gather(*(
+                self.check_file_extensions(urls[0],i,zeros)
+                for i in range(index, index+self.CONCURRENCY)))
+            for url in checked:
+                if url is None:
+                    check_over = False
+                    break
+                found(url)
+            index += self.CONCURRENCY
+
+        urls.sort(key=self.url_index)
+
+        if use_url_file and not update_file_every_url:
+            self.add_urls_file(urls)
+
+        return urls
+
+    # =========================================================================
+    # download workers
+
+    async def download_url(self, url, path, dlpath=None, special_filename=None):
+        """
+        Downloads a file and saves it to path, same as `NekosLife.download_url`.
+        Dlpath will be the file path while still downloading, existing ones are resumed.
+        Returns how long the download took.
+        """
+        start = time.time()
+        if dlpath is None:
+            dlpath = path
+
+        resume_from = 0
+        if dlpath != path and os.path.isfile(dlpath):
+            resume_from = os.path.getsize(dlpath)
+        headers = {'Range': f'bytes={resume_from}-'} if resume_from else {}
+
+        async with self._semaphore:
+            async with await self.scheduler.request('GET', url, headers=headers) as r:
+                resumed = r.status == 206
+                if (r.status == 416 or resumed and
+                    not r.headers.get('Content-Range', '').startswith(f'bytes {resume_from}-')):
+                    os.remove(dlpath)
+                    resume_from = None
+                else:
+                    r.raise_for_status()
+                    with open(dlpath, 'ab' if resumed else 'wb') as file:
+                        async for chunk in r.content.iter_chunked(self.CHUNK_SIZE):
+                            file.write(chunk)
+                            self._count_bytes(len(chunk))
+
+        if resume_from is None:
+            # the partial file doesn't fit the real file anymore
+            return await self.download_url(url, path, dlpath, special_filename)
+        os.rename(dlpath, path)
+
+        return time.time() - start
+
+    async def download_worker(self):
+        """
+        Gets urls from `dlqueue` and downloads them.
+        Updates the estimated time and prints progress bar every download.
+        """
+        while True:
+            url, path, filename = await self.dlqueue.get()
+
+            success = False
+            try:
+                dlpath = path+'.000'
+                dl_time = await self.download_url(url, path, dlpath, filename)
+                self.add_downloaded(filename)
+                self.update_estimated_time(dl_time)
+                success = True
+            except aiohttp.ClientResponseError as e:
+                if self.is_bad_url_status(e.status) and os.path.isfile(dlpath):
+                    os.remove(dlpath) # the url itself is bad, nothing to resume
+                self.failed_urls.append(url)
+            except Exception:
+                self.failed_urls.append(url)
+            self.metrics.counter('nekoslife_downloads_total',
+                'Finished downloads, by result').inc(result='downloaded' if success else 'failed')
+
+            self.print_progress_bar()
+            self.dlqueue.task_done()
+            self._notify_download(url, path, filename, success)
+
+    def _start_download_workers(self, amount, min_amount=1, max_amount=None):
+        """
+        Starts a set amount of download worker tasks, they don't autoscale.
+        """
+        self._download_workers = [
+            asyncio.ensure_future(self.download_worker()) for i in range(amount)]
+
+    # =========================================================================
+    # transport
+
+    def create_session(self, pool_size=1):
+        """
+        Creates a keep-alive session with a connection pool for each host.
+        """
+        if isinstance(self.TIMEOUT, tuple):
+            connect, read = self.TIMEOUT
+        else:
+            connect = read = self.TIMEOUT
+        connector = aiohttp.TCPConnector(limit=pool_size, limit_per_host=pool_size)
+        timeout = aiohttp.ClientTimeout(sock_connect=connect, sock_read=read)
+        return aiohttp.ClientSession(connector=connector, timeout=timeout)
+
+    def _init_transport(self, session, rate_limit, retries, pool_size):
+        """
+        Makes the `scheduler`, the session can only be made inside the event loop by `open`.
+        Should only be used internally.
+        """
+        self.session = None
+        self.scheduler = AsyncRequestScheduler(None, rate=rate_limit, retries=retries,
+                                               metrics=self.metrics)
+
+    async def request(self, method, url, **kwargs):
+        """
+        Sends a request through `scheduler`, rate limited and retried like in `NekosLife`.
+        Returns `(status, json)`, json is None if the response isn't json.
+        """
+        async with self._semaphore:
+            try:
+                r = await self.scheduler.request(method, url, **kwargs)
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                self.metrics.counter('nekoslife_request_errors_total',
+                    'Requests that failed without a response').inc(method=method, error=type(e).__name__)
+                raise
+            async with r:
+                self.metrics.counter('nekoslife_responses_total',
+                    'Responses, by status').inc(method=method, status=r.status)
+                if method == 'HEAD':
+                    return r.status, None
+                try:
+                    return r.status, await r.json(content_type=None)
+                except ValueError:
+                    return r.status, None
+
+    # =========================================================================
+    # utility
+
+    async def get_endpoints(self, force=False) -> dict:
+        """
+        Gets all endpoints by requesting bad urls and getting corrected.
+        If endpoints have been already once generated, returns the old endpoints.
+        Otherwise they're read from `ENDPOINTS_CACHE`, unless it's older than `ENDPOINTS_TTL`.
+        To overcome this use `force`.
+        """
+        if self.endpoints and not force:
+            return self.endpoints
+
+        if not force:
+            endpoints, age = self._load_endpoints_cache()
+            if endpoints is not None and age <= self.ENDPOINTS_TTL:
+                self.endpoints = endpoints
+                return endpoints
+
+        pairs = [(i, j) for i in self.ENDPOINT_TYPES for j in self.ENDPOINT_FORMATS]
+        urls = [self.IMAGES_URL+i+'/'+j+'/' for i, j in pairs]
+        responses = await asyncio.gather(*(self.request('GET', url) for url in urls))
+
+        endpoints = {i: {} for i in self.ENDPOINT_TYPES}
+        for (i, j), url, (status, data) in zip(pairs, urls, responses):
+            if status != 200:
+                raise requests.HTTPError(f'{status} Error for url: {url}')
+            endpoints[i][j] = data['data']['response']['categories']
+
+        self.endpoints = endpoints
+        self._save_endpoints_cache(endpoints)
+
+        return endpoints
+
+    async def raise_for_category(self, imgtype, imgformat, imgcategory, endpoints=None):
+        """
+        Raises ValueError if category is invalid.
+        """
+        if endpoints is None:
+            endpoints = await self.get_endpoints()
+        return super().raise_for_category(imgtype, imgformat, imgcategory, endpoints)
+
+    def empty_dlqueue(self):
+        """
+        Marks all unstarted tasks as done.
+        """
+        while not self.dlqueue.empty():
+            self.dlqueue.get_nowait()
+            self.dlqueue.task_done()
+
+
+class BlockingNekosLife:
+    """
+    Runs `AsyncNekosLife` in an event loop on a background thread,
+    while exposing the same blocking methods as `NekosLife`.
+    ```
+    from nekoslife_dl import BlockingNekosLife
+    nekoslife = BlockingNekosLife(...)
+    nekoslife.get_multiple_images(...,add_to_dlqueue=True)
+    nekoslife.wait_until_finished()
+    ```
+    Any other attribute is taken from the wrapped `nekoslife`.
+    """
+    def __init__(self, *args, **kwargs):
+        """
+        Takes the same arguments as `AsyncNekosLife`.
+        """
+        self.nekoslife = AsyncNekosLife(*args, **kwargs)
+        self.loop = asyncio.new_event_loop()
+        self._loop_thread = threading.Thread(target=self.loop.run_forever,
+                                             name='nlasyncloop', daemon=True)
+        self._loop_thread.start()
+        self._call(self.nekoslife.open())
+
+    def __getattr__(self, name):
+        return getattr(self.nekoslife, name)
+
+    def _call(self, coro):
+        """
+        Runs a coroutine in the loop and waits for its result.
+        """
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result()
+
+    def get_images(self, *args, **kwargs):
+        return self._call(self.nekoslife.get_images(*args, **kwargs))
+
+    def get_multiple_images(self, *args, **kwargs):
+        return self._call(self.nekoslife.get_multiple_images(*args, **kwargs))
+
+    def autocomplete_urls(self, *args, **kwargs):
+        return self._call(self.nekoslife.autocomplete_urls(*args, **kwargs))
+
+    def get_endpoints(self, *args, **kwargs):
+        return self._call(self.nekoslife.get_endpoints(*args, **kwargs))
+
+    def raise_for_category(self, *args, **kwargs):
+        return self._call(self.nekoslife.raise_for_category(*args, **kwargs))
+
+    def add_to_dlqueue(self, urls):
+        return self.loop.call_soon_threadsafe(self.nekoslife.add_to_dlqueue, list(urls))
+
+    def wait_until_finished(self, timeout=60*60):
+        return self._call(self.nekoslife.wait_until_finished(timeout))
+
+    def close(self):
+        """
+        Closes the session and stops the event loop.
+        """
+        self._call(self.nekoslife.close())
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._loop_thread.join()
+        self.loop.close()
@@ -0,0 +1,135 @@
+"""
+The checkpoint file
+Contains Checkpoint, which saves how far a download got so it can be resumed
+"""
+import json
+import os
+import threading
+import time
+
+
+class Checkpoint:
+    """
+    Remembers the progress of a `NekosLife` in a json file, so an interrupted run can continue:
+    - the urls every category got from the API so far, and whether it got all it wanted
+    - how far autocomplete got in every category and the urls it found
+    - the urls waiting in the download queue
+    ```
+    checkpoint = Checkpoint('run.checkpoint.json', resume=True)
+    nekoslife = NekosLife(..., checkpoint=checkpoint)
+    checkpoint.save_every(30)
+    ```
+    Every category is only harvested and autocompleted once per checkpoint, \
+    a resumed run gets the rest of what the interrupted one asked for.
+    """
+    def __init__(self, path, resume=False):
+        """
+        `path` is the checkpoint file. With `resume`, it's loaded if it exists, \
+        otherwise it's overwritten by the first save.
+        """
+        self.path = path
+        self.harvest = {} # category -> {"urls", "requested", "done"}
+        self.autocomplete = {} # category -> {"cursor", "last_index", "found"}
+        self.queue = [] # urls that were queued when the checkpoint was loaded
+        self.dlqueue = None
+        self._lock = threading.Lock()
+        self._saving = threading.Lock()
+        if resume and os.path.isfile(path):
+            self.load()
+
+    def load(self):
+        with open(self.path) as file:
+            data = json.load(file)
+        self.harvest = data.get('harvest', {})
+        self.autocomplete = data.get('autocomplete', {})
+        self.queue = data.get('queue', [])
+
+    def snapshot(self):
+        """
+        Returns the checkpoint as a json serializable dict.
+        Only queues with `queued()` are saved, `SQLiteQueue` is already on disk.
+        """
+        queue = self.queue
+        if self.dlqueue is not None and hasattr(self.dlqueue, 'queued'):
+            queue = self.dlqueue.queued()
+        with self._lock:
+            return {
+                'time': time.time(),
+                'harvest': {c: dict(s, urls=list(s['urls'])) for c, s in self.harvest.items()},
+                'autocomplete': {c: dict(s, found=list(s['found']))
+                                 for c, s in self.autocomplete.items()},
+                'queue': queue,
+            }
+
+    def save(self):
+        """
+        Writes the checkpoint, the file is replaced at once so a crash never leaves half of it.
+        """
+        text = json.dumps(self.snapshot())
+        with self._saving:
+            with open(self.path+'.000', 'w') as file:
+                file.write(text)
+            os.replace(self.path+'.000', self.path)
+
+    def save_every(self, interval=30):
+        """
+        Saves every `interval` seconds on a daemon thread.
+        """
+        def saver():
+            while True:
+                time.sleep(interval)
+                self.save()
+
+        thread = threading.Thread(target=saver, name='nlcheckpoint', daemon=True)
+        thread.start()
+        return thread
+
+    def remove(self):
+        """
+        Deletes the checkpoint file, use once everything is done.
+        """
+        if os.path.isfile(self.path):
+            os.remove(self.path)
+
+    # =========================================================================
+    # progress
+
+    def get_harvest(self, category):
+        """
+        Returns `{"urls", "requested", "done"}` of a category, None if it wasn't started.
+        """
+        with self._lock:
+            state = self.harvest.get(category)
+            return None if state is None else dict(state, urls=list(state['urls']))
+
+    def update_harvest(self, category, new_urls=(), requested=0, done=False):
+        """
+        Records `new_urls` gotten from `requested` more urls asked for.
+        """
+        with self._lock:
+            state = self.harvest.setdefault(category, {'urls': [], 'requested': 0, 'done': False})
+            state['urls'].extend(new_urls)
+            state['requested'] += requested
+            state['done'] = state['done'] or done
+
+    def get_autocomplete(self, category):
+        """
+        Returns `{"cursor", "last_index", "found"}` of a category.
+        Every missing index up to `cursor` was checked, `last_index` is the highest index \
+        or None if it wasn't searched for yet.
+        """
+        with self._lock:
+            state = self.autocomplete.get(category)
+            if state is None:
+                return {'cursor': 0, 'last_index': None, 'found': []}
+            return dict(state, found=list(state['found']))
+
+    def update_autocomplete(self, category, cursor=None, found=(), last_index=None):
+        with self._lock:
+            state = self.autocomplete.setdefault(category,
+                {'cursor': 0, 'last_index': None, 'found': []})
+            state['found'].extend(found)
+            if cursor is not None:
+                state['cursor'] = max(state['cursor'], cursor)
+            if last_index is not None:
+                state['last_index'] = last_index
@@ -0,0 +1,85 @@
+"""
+The hash index file
+Contains HashIndex, which finds downloaded images with the same content
+"""
+import os
+import sqlite3
+import threading
+
+
+class HashIndex:
+    """
+    Remembers the content hash of every downloaded file in an sqlite database.
+    Used to find images that are the same, even when their filenames aren't.
+    ```
+    index = HashIndex('hashes.db')
+    original = index.add(filename, digest, path)
+    if original is not None:
+        ... # path is a duplicate of original
+    ```
+    """
+    POLICIES = ('record', 'skip', 'hardlink')
+
+    def __init__(self, path):
+        """
+        `path` is the database file, it's created if it doesn't exist.
+        """
+        self.path = path
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        with self._connection:
+            self._connection.execute(
+                'CREATE TABLE IF NOT EXISTS files '
+                '(filename TEXT PRIMARY KEY, hash TEXT NOT NULL, path TEXT NOT NULL, '
+                'duplicate_of TEXT)')
+            self._connection.execute(
+                'CREATE INDEX IF NOT EXISTS files_hash ON files (hash)')
+
+    def __contains__(self, filename):
+        return self.get_hash(filename) is not None
+
+    def add(self, filename, digest, path):
+        """
+        Records the hash of a file.
+        If a file with the same hash still exists, returns its path and marks this one as its duplicate.
+        Returns None if the file is an original.
+        """
+        with self._lock, self._connection:
+            rows = self._connection.execute(
+                'SELECT path FROM files WHERE hash = ? AND duplicate_of IS NULL AND filename != ?',
+                (digest, filename))
+            original = next((p for p, in rows if os.path.isfile(p)), None)
+
+            self._connection.execute(
+                'INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?)',
+                (filename, digest, path, original))
+        return original
+
+    def get_hash(self, filename):
+        """
+        Gets the recorded hash of a file, None if it's not known.
+        """
+        with self._lock:
+            row = self._connection.execute(
+                'SELECT hash FROM files WHERE filename = ?', (filename,)).fetchone()
+        return None if row is None else row[0]
+
+    def is_duplicate(self, filename) -> bool:
+        """
+        Checks if a file was recorded as a duplicate of another one.
+        """
+        with self._lock:
+            row = self._connection.execute(
+                'SELECT duplicate_of FROM files WHERE filename = ?', (filename,)).fetchone()
+        return row is not None and row[0] is not None
+
+    def get_duplicates(self):
+        """
+        Returns a list of `(path, path_of_original)` of all recorded duplicates.
+        """
+        with self._lock:
+            return self._connection.execute(
+                'SELECT path, duplicate_of FROM files WHERE duplicate_of IS NOT NULL').fetchall()
+
+    def close(self):
+        self._connection.close()
@@ -0,0 +1,159 @@
+"""
+The jobs file
+Contains Job and JobRunner, which get images from many categories in one NekosLife
+"""
+import json
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from fnmatch import fnmatchcase
+
+
+class Job:
+    """
+    One category to get images from, with its own settings.
+    The settings are the same as the arguments of `nekoslife-dl.py`.
+    `expected` is the leeway of `use_expected_unique`, None to not use it.
+    """
+    SETTINGS = {'amount': 20, 'unique': 0, 'expected': None, 'autocomplete': False}
+
+    def __init__(self, imgtype, imgformat, imgcategory,
+                 amount=20, unique=0, expected=None, autocomplete=False):
+        self.imgtype = imgtype
+        self.imgformat = imgformat
+        self.imgcategory = imgcategory
+        self.amount = amount
+        self.unique = unique
+        self.expected = expected
+        self.autocomplete = autocomplete
+
+        self.urls = []
+
+    def __repr__(self):
+        return f'Job({self.category!r})'
+
+    @property
+    def category(self):
+        return f'{self.imgtype}/{self.imgformat}/{self.imgcategory}'
+
+    @classmethod
+    def from_dict(cls, data, endpoints, defaults=None):
+        """
+        Makes jobs from a dict in a job file.
+        `type`, `format` and `category` can be glob patterns like `*` or `ne?o`,
+        one job is made for every matching category in `endpoints`.
+        Settings that aren't in data are taken from `defaults`, then `SETTINGS`.
+        """
+        settings = {**cls.SETTINGS, **(defaults or {})}
+        settings.update((k, v) for k, v in data.items() if k in cls.SETTINGS)
+
+        jobs = []
+        for imgtype, formats in endpoints.items():
+            if not fnmatchcase(imgtype, data.get('type', '*')):
+                continue
+            for imgformat, categories in formats.items():
+                if not fnmatchcase(imgformat, data.get('format', '*')):
+                    continue
+                for imgcategory in categories:
+                    if fnmatchcase(imgcategory, data['category']):
+                        jobs.append(cls(imgtype, imgformat, imgcategory, **settings))
+
+        if not jobs:
+            raise ValueError(f'No category matches {data!r}, check endpoints.')
+        return jobs
+
+
+def load_jobs(path, endpoints, defaults=None):
+    """
+    Loads jobs from a json job file, it's either a list of jobs or
+    `{"defaults": {...}, "jobs": [...]}`. A job looks like this
+    ```
+    {"type": "sfw", "format": "img", "category": "ne*", "amount": 200, "autocomplete": true}
+    ```
+    `defaults` are used for settings that neither the job nor the file set.
+    The same category is never added twice.
+    """
+    with open(path, 'r') as file:
+        data = json.load(file)
+    if isinstance(data, list):
+        data = {'jobs': data}
+    defaults = {**(defaults or {}), **data.get('defaults', {})}
+
+    jobs = {}
+    for job_data in data['jobs']:
+        for job in Job.from_dict(job_data, endpoints, defaults):
+            jobs.setdefault(job.category, job)
+    return list(jobs.values())
+
+
+class JobRunner:
+    """
+    Gets images of many jobs with one `NekosLife`, so they share its connections,
+    download workers and url file.
+    Jobs take turns, every job gets one API request per round,
+    so big categories don't hold back small ones.
+    Jobs are autocompleted in the background while the others keep taking turns.
+    ```
+    runner = JobRunner(nekoslife, load_jobs('jobs.json', nekoslife.get_endpoints()))
+    runner.run()
+    ```
+    """
+    AUTOCOMPLETE_THREADS = 1  # jobs autocompleted at once, each probes with PROBE_THREADS
+
+    def __init__(self, nekoslife, jobs, use_url_file=False, update_file_every_url=False):
+        """
+        `use_url_file` and `update_file_every_url` are passed to every job.
+        """
+        self.nekoslife = nekoslife
+        self.jobs = jobs
+        self.use_url_file = use_url_file
+        self.update_file_every_url = update_file_every_url
+
+    def start_job(self, job):
+        """
+        Returns the generator getting images of a job.
+        """
+        unique = job.unique if job.expected is None else 0xffffffff
+        return self.nekoslife.iter_multiple_images(
+            job.imgtype, job.imgformat, job.imgcategory,
+            amount = job.amount,
+            add_to_dlqueue = True,
+            use_url_file = self.use_url_file,
+            unique = unique,
+            use_expected_unique = job.expected is not None,
+            expected_unique_leeway = job.expected)
+
+    def finish_job(self, job):
+        """
+        Called once a job got all its urls, autocompletes if the job wants to.
+        Runs on a background thread.
+        """
+        if job.autocomplete:
+            job.urls = self.nekoslife.autocomplete_urls(job.urls,
+                add_to_dlqueue=True,
+                use_url_file=self.use_url_file,
+                update_file_every_url=self.update_file_every_url)
+
+    def run(self, timeout=60*60):
+        """
+        Gets the urls of all jobs, then waits until everything is downloaded.
+        Returns True when everything was downloaded.
+        """
+        executor = ThreadPoolExecutor(self.AUTOCOMPLETE_THREADS, thread_name_prefix='nljobs')
+        finishing = []
+        try:
+            running = deque((job, self.start_job(job)) for job in self.jobs)
+            while running:
+                job, harvest = running.popleft()
+                try:
+                    job.urls = next(harvest)
+                except StopIteration:
+                    finishing.append(executor.submit(self.finish_job, job))
+                else:
+                    running.append((job, harvest))
+
+            for future in finishing:
+                future.result()
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+        return self.nekoslife.wait_until_finished(timeout)
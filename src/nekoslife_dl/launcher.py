@@ -0,0 +1,93 @@
+"""
+The launcher file
+Contains Shard and launch, which split work between several processes or hosts
+"""
+import subprocess
+import sys
+
+
+class Shard:
+    """
+    Part `index` of `count` equal parts of some work, written as `index/count`.
+    Every process gets a different index, for example `0/4`, `1/4`, `2/4` and `3/4`.
+    ```
+    shard = Shard.parse('1/4')
+    jobs = shard.select(jobs)
+    ```
+    """
+    def __init__(self, index=0, count=1):
+        if not 0 <= index < count:
+            raise ValueError(f'shard index must be in [0,{count}), got {index}')
+        self.index = index
+        self.count = count
+
+    def __repr__(self):
+        return f'Shard({self.index}/{self.count})'
+
+    @classmethod
+    def parse(cls, text):
+        """
+        Makes a shard from `index/count`.
+        """
+        try:
+            index, count = map(int, text.split('/'))
+        except ValueError:
+            raise ValueError(f'shard must look like index/count, got {text!r}') from None
+        return cls(index, count)
+
+    def select(self, items):
+        """
+        Takes every `count`th item, starting at `index`.
+        """
+        return items[self.index::self.count]
+
+    def split(self, amount):
+        """
+        This shard's part of an amount, all parts add up to `amount`.
+        """
+        return amount//self.count + (self.index < amount%self.count)
+
+    def owns(self, index) -> bool:
+        """
+        Checks if an image index belongs to this shard.
+        """
+        return index % self.count == self.index
+
+
+def strip_option(argv, *names):
+    """
+    Removes an option and its value from command line arguments.
+    Both `--option value` and `--option=value` are removed.
+    """
+    args = []
+    skip = False
+    for arg in argv:
+        if skip:
+            skip = False
+        elif arg in names:
+            skip = True
+        elif not arg.startswith(tuple(name+'=' for name in names)):
+            args.append(arg)
+    return args
+
+
+def launch(script, argv, processes, extra=None):
+    """
+    Runs `processes` copies of a python script, each with `--shard index/processes` added \
+    to `argv`. `extra(index)` can return more arguments for a copy.
+    Waits until all of them exit and returns the highest exit code.
+    On KeyboardInterrupt, all copies are stopped.
+    """
+    children = []
+    for index in range(processes):
+        args = [*argv, '--shard', f'{index}/{processes}', *(extra(index) if extra else ())]
+        children.append(subprocess.Popen([sys.executable, script, *args]))
+
+    try:
+        return max(child.wait() for child in children)
+    except KeyboardInterrupt:
+        for child in children:
+            child.terminate()
+        for child in children:
+            child.wait()
+        raise
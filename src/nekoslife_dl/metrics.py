@@ -0,0 +1,315 @@
+"""
+The metrics file
+Contains Metrics, a registry of counters, gauges and histograms exported as json or prometheus text
+"""
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+from collections import deque
+
+
+class Metric:
+    """
+    Base of all metrics. Every metric has a value for each set of labels.
+    Labels are passed as keyword arguments, for example `counter.inc(status=200)`.
+    """
+    TYPE = None
+
+    def __init__(self, name, help=''):
+        self.name = name
+        self.help = help
+        self.values = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(labels):
+        return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+    def get(self, **labels):
+        """
+        Gets the value for labels, 0 if there's none.
+        """
+        return self.values.get(self._key(labels), 0)
+
+    def snapshot(self):
+        """
+        Returns `[{"labels": {...}, "value": ...}]`.
+        """
+        with self._lock:
+            return [{'labels': dict(key), 'value': value} for key, value in self.values.items()]
+
+    def samples(self):
+        """
+        Returns `[(suffix, labels, value)]` for the prometheus text format.
+        """
+        with self._lock:
+            return [('', dict(key), value) for key, value in self.values.items()]
+
+
+class Counter(Metric):
+    """
+    A number that only goes up, like requests sent or bytes downloaded.
+    """
+    TYPE = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    """
+    A number that goes up and down, like the queue depth.
+    With a `function`, it's called every time the gauge is read.
+    """
+    TYPE = 'gauge'
+
+    def __init__(self, name, help='', function=None):
+        super().__init__(name, help)
+        self.function = function
+
+    def set(self, value, **labels):
+        with self._lock:
+            self.values[self._key(labels)] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def _update(self):
+        if self.function is not None:
+            self.set(self.function())
+
+    def get(self, **labels):
+        self._update()
+        return super().get(**labels)
+
+    def snapshot(self):
+        self._update()
+        return super().snapshot()
+
+    def samples(self):
+        self._update()
+        return super().samples()
+
+
+class Histogram(Metric):
+    """
+    Counts values into `buckets`, like request latencies.
+    The value of a histogram is `{"count", "sum", "buckets"}`, buckets are cumulative.
+    """
+    TYPE = 'histogram'
+    BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+    def __init__(self, name, help='', buckets=None):
+        super().__init__(name, help)
+        self.buckets = tuple(sorted(buckets or self.BUCKETS))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            if key not in self.values:
+                self.values[key] = {'count': 0, 'sum': 0, 'buckets': [0]*len(self.buckets)}
+            data = self.values[key]
+            data['count'] += 1
+            data['sum'] += value
+            i = bisect_left(self.buckets, value)
+            if i < len(self.buckets):
+                data['buckets'][i] += 1
+
+    def time(self, **labels):
+        """
+        Context manager that observes how many seconds its block took.
+        """
+        return _Timer(self, labels)
+
+    def _cumulative(self, data):
+        total = 0
+        buckets = {}
+        for bound, count in zip(self.buckets, data['buckets']):
+            total += count
+            buckets[bound] = total
+        return buckets
+
+    def get(self, **labels):
+        with self._lock:
+            data = self.values.get(self._key(labels))
+            if data is None:
+                return {'count': 0, 'sum': 0, 'buckets': {}}
+            return {'count': data['count'], 'sum': data['sum'], 'buckets': self._cumulative(data)}
+
+    def snapshot(self):
+        with self._lock:
+            return [{'labels': dict(key), 'value': {
+                        'count': data['count'], 'sum': data['sum'],
+                        'buckets': {str(b): c for b, c in self._cumulative(data).items()}}}
+                    for key, data in self.values.items()]
+
+    def samples(self):
+        samples = []
+        with self._lock:
+            for key, data in self.values.items():
+                labels = dict(key)
+                for bound, count in self._cumulative(data).items():
+                    samples.append(('_bucket', {**labels, 'le': str(bound)}, count))
+                samples.append(('_bucket', {**labels, 'le': '+Inf'}, data['count']))
+                samples.append(('_sum', labels, data['sum']))
+                samples.append(('_count', labels, data['count']))
+        return samples
+
+
+class _Timer:
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.monotonic()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.monotonic() - self.start, **self.labels)
+
+
+class RateMeter:
+    """
+    Measures how many things happen per second over the last `window` seconds.
+    Used for throughput, for example images or bytes per second.
+    """
+    def __init__(self, window=30):
+        self.window = window
+        self.start = time.monotonic()
+        self.events = deque()
+        self._lock = threading.Lock()
+
+    def add(self, amount=1):
+        now = time.monotonic()
+        with self._lock:
+            self.events.append((now, amount))
+            self._trim(now)
+
+    def rate(self):
+        """
+        Things per second, 0 if nothing happened yet.
+        """
+        now = time.monotonic()
+        with self._lock:
+            self._trim(now)
+            if not self.events:
+                return 0
+            elapsed = min(now - self.start, self.window)
+            return sum(amount for _, amount in self.events) / max(elapsed, 1e-3)
+
+    def _trim(self, now):
+        while self.events and self.events[0][0] < now - self.window:
+            self.events.popleft()
+
+
+class Metrics:
+    """
+    A registry of metrics, exported as a json snapshot or the prometheus text format.
+    Metrics are made the first time they're asked for, later calls return the same one.
+    A metric made without help text gets the first one a later call gives.
+    ```
+    metrics = Metrics()
+    metrics.counter('requests_total', 'Requests sent').inc(status=200)
+    with metrics.histogram('request_seconds').time():
+        ...
+    metrics.save('metrics.prom')
+    ```
+    """
+    def __init__(self):
+        self.metrics = {}
+        self._lock = threading.Lock()
+
+    def _get(self, cls, name, help, *args):
+        with self._lock:
+            if name not in self.metrics:
+                self.metrics[name] = cls(name, help, *args)
+            metric = self.metrics[name]
+            if help and not metric.help:
+                metric.help = help
+        if not isinstance(metric, cls):
+            raise TypeError(f'{name} is a {metric.TYPE}, not a {cls.TYPE}')
+        return metric
+
+    def counter(self, name, help='') -> Counter:
+        return self._get(Counter, name, help)
+
+    def gauge(self, name, help='', function=None) -> Gauge:
+        return self._get(Gauge, name, help, function)
+
+    def histogram(self, name, help='', buckets=None) -> Histogram:
+        return self._get(Histogram, name, help, buckets)
+
+    # =========================================================================
+    # export
+
+    def snapshot(self):
+        """
+        Returns all metrics as a json serializable dict.
+        """
+        with self._lock:
+            metrics = list(self.metrics.values())
+        return {
+            'time': time.time(),
+            'metrics': {m.name: {'type': m.TYPE, 'help': m.help, 'values': m.snapshot()}
+                        for m in metrics},
+        }
+
+    def to_json(self):
+        return json.dumps(self.snapshot(), indent=4)
+
+    def to_prometheus(self):
+        """
+        Returns all metrics in the prometheus text format.
+        """
+        with self._lock:
+            metrics = list(self.metrics.values())
+        lines = []
+        for metric in metrics:
+            if metric.help:
+                lines.append(f'# HELP {metric.name} {metric.help}')
+            lines.append(f'# TYPE {metric.name} {metric.TYPE}')
+            for suffix, labels, value in metric.samples():
+                lines.append(f'{metric.name}{suffix}{self._format_labels(labels)} {value}')
+        return '\n'.join(lines) + '\n'
+
+    @staticmethod
+    def _format_labels(labels):
+        if not labels:
+            return ''
+        escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+                   for v in labels.values())
+        return '{' + ','.join(f'{k}="{v}"' for k, v in zip(labels, escaped)) + '}'
+
+    def save(self, path):
+        """
+        Writes all metrics into a file, in the prometheus text format \
+        if it ends with `.prom`, otherwise as json.
+        The file is replaced at once, so readers never see half of it.
+        """
+        text = self.to_prometheus() if path.endswith('.prom') else self.to_json()
+        with open(path+'.000', 'w') as file:
+            file.write(text)
+        os.replace(path+'.000', path)
+
+    def save_every(self, path, interval=10):
+        """
+        Saves into `path` every `interval` seconds on a daemon thread.
+        """
+        def saver():
+            while True:
+                time.sleep(interval)
+                self.save(path)
+
+        thread = threading.Thread(target=saver, name='nlmetrics', daemon=True)
+        thread.start()
+        return thread
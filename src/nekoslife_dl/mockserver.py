@@ -0,0 +1,249 @@
+"""
+The mock server file
+Contains MockServer, a local stand-in for the nekos.life v3 API and CDN
+"""
+import json
+import random
+import re
+import threading
+import time
+from collections import Counter
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+
+class MockServer:
+    """
+    Serves the v3 API (`images/{t}/{f}/{c}/?count=`) and the CDN file layout on localhost,
+    so everything can be run and measured offline.
+    ```
+    with MockServer(images=500, latency=0.05) as server:
+        nekoslife = NekosLife(...)
+        server.patch(nekoslife)
+        nekoslife.get_multiple_images(...)
+    print(server.requests)
+    ```
+    Which indexes are missing and what extension and size an image has only depends on `seed`,
+    so runs with the same settings are the same.
+    """
+    CATEGORIES = {
+        'sfw': {'img': ['neko', 'kitsune', 'waifu'], 'gif': ['neko', 'hug']},
+        'nsfw': {'img': ['neko', 'yuri'], 'gif': ['neko', 'yuri']},
+    }
+    MAX_IMAGE_COUNT = 20
+    API_REGEX = re.compile(r'/api/v3/images/(\w+)/(\w+)/(?:(\w+)/)?(?:\?count=(\d+))?$')
+    CDN_REGEX = re.compile(r'/v3/(\w+)/(\w+)/(\w+)/(\w+)_(\d+)\.(\w+)$')
+
+    def __init__(self, categories=None, images=200, missing=(), missing_rate=0,
+                 extensions=('png', 'jpg'), size=0x4000, padding=3,
+                 latency=0, cdn_latency=0, error_rate=0, seed=0, port=0):
+        """
+        `categories` are `{type: {format: [category]}}`, `CATEGORIES` by default.
+        `images` is how many indexes every category has.
+        `missing` indexes and a `missing_rate` of random other ones don't exist.
+        `extensions` are used for img categories, gif categories are always gif.
+        `size` is the size of images in bytes, either a number or `(min, max)`.
+        `padding` is the width indexes are padded to with zeros.
+        `latency` and `cdn_latency` are seconds added to every API and CDN response.
+        `error_rate` is the part of responses that fail with 500.
+        `port` 0 picks a free one.
+        """
+        self.categories = categories or self.CATEGORIES
+        self.images = images
+        self.missing = set(missing)
+        self.missing_rate = missing_rate
+        self.extensions = extensions
+        self.size = size
+        self.padding = padding
+        self.latency = latency
+        self.cdn_latency = cdn_latency
+        self.error_rate = error_rate
+        self.seed = seed
+
+        self.requests = Counter()
+        self._lock = threading.Lock()
+        self._random = random.Random(seed)
+        self._server = _Server(('127.0.0.1', port), self._make_handler())
+        self._thread = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    @property
+    def url(self):
+        return f'http://127.0.0.1:{self._server.server_port}'
+
+    def start(self):
+        """
+        Starts serving on a daemon thread.
+        """
+        self._thread = threading.Thread(target=self._server.serve_forever,
+                                        name='nlmockserver', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def patch(self, nekoslife):
+        """
+        Points a `NekosLife` (or `BlockingNekosLife`) at this server instead of nekos.life.
+        """
+        nekoslife = getattr(nekoslife, 'nekoslife', nekoslife)
+        nekoslife.URL = self.url+'/api/v3/'
+        nekoslife.IMAGES_URL = nekoslife.URL+'images/'
+        nekoslife.GET_URL = nekoslife.IMAGES_URL+'{t}/{f}/{c}/?count={a}'
+        nekoslife.CDN_URL = self.url+'/v3/{t}/{f}/{c}/{i}'
+        nekoslife.endpoints = {}
+        return nekoslife
+
+    def reset(self):
+        """
+        Clears the request counts.
+        """
+        with self._lock:
+            self.requests.clear()
+
+    # =========================================================================
+    # images
+
+    def _image_random(self, category, index):
+        return random.Random(f'{self.seed}/{category}/{index}')
+
+    def image_exists(self, category, index) -> bool:
+        if not 1 <= index <= self.images or index in self.missing:
+            return False
+        return self._image_random(category, index).random() >= self.missing_rate
+
+    def image_filename(self, imgtype, imgformat, imgcategory, index):
+        """
+        The filename of an index, whether it exists or not.
+        """
+        rng = self._image_random(f'{imgtype}/{imgformat}/{imgcategory}', index)
+        rng.random()
+        extension = 'gif' if imgformat == 'gif' else rng.choice(self.extensions)
+        return f'{imgcategory}_{str(index).zfill(self.padding)}.{extension}'
+
+    def image_url(self, imgtype, imgformat, imgcategory, index):
+        filename = self.image_filename(imgtype, imgformat, imgcategory, index)
+        return f'{self.url}/v3/{imgtype}/{imgformat}/{imgcategory}/{filename}'
+
+    def image_content(self, category, index):
+        rng = self._image_random(category, index)
+        size = self.size if isinstance(self.size, int) else rng.randint(*self.size)
+        pattern = f'{category}/{index}\n'.encode()
+        return (pattern * (size//len(pattern) + 1))[:size]
+
+    def existing_indexes(self, imgtype, imgformat, imgcategory):
+        category = f'{imgtype}/{imgformat}/{imgcategory}'
+        return [i for i in range(1, self.images+1) if self.image_exists(category, i)]
+
+    # =========================================================================
+    # http
+
+    def _count(self, kind):
+        with self._lock:
+            self.requests[kind] += 1
+
+    def _should_fail(self):
+        with self._lock:
+            return self._random.random() < self.error_rate
+
+    def _api(self, match):
+        """
+        Returns the json of an API request.
+        """
+        imgtype, imgformat, imgcategory, count = match.groups()
+        categories = self.categories.get(imgtype, {}).get(imgformat)
+        if categories is None:
+            return {'data': {'status': {'success': False, 'message': 'Bad type or format'}}}
+        if imgcategory is None:
+            return {'data': {'status': {'success': False}, 'response': {'categories': categories}}}
+        count = int(count or 0)
+        if imgcategory not in categories or not 2 <= count <= self.MAX_IMAGE_COUNT:
+            return {'data': {'status': {'success': False}, 'response': {'categories': categories}}}
+
+        indexes = self.existing_indexes(imgtype, imgformat, imgcategory)
+        with self._lock:
+            indexes = self._random.sample(indexes, min(count, len(indexes)))
+        urls = [self.image_url(imgtype, imgformat, imgcategory, i) for i in indexes]
+        return {'data': {'status': {'success': True}, 'response': {'urls': urls}}}
+
+    def _cdn(self, match):
+        """
+        Returns the content of a CDN request, None if there's no such image.
+        """
+        imgtype, imgformat, imgcategory, prefix, digits, extension = match.groups()
+        index = int(digits)
+        category = f'{imgtype}/{imgformat}/{imgcategory}'
+        if (imgcategory not in self.categories.get(imgtype, {}).get(imgformat, ())
+            or prefix != imgcategory or not self.image_exists(category, index)
+            or f'{prefix}_{digits}.{extension}' != self.image_filename(
+                imgtype, imgformat, imgcategory, index)):
+            return None
+        return self.image_content(category, index)
+
+    def _make_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, *args):
+                pass
+
+            def do_HEAD(self):
+                self.do_GET(head=True)
+
+            def do_GET(self, head=False):
+                api = server.API_REGEX.match(self.path)
+                cdn = None if api else server.CDN_REGEX.match(self.path)
+                time.sleep(server.latency if api else server.cdn_latency)
+
+                if server._should_fail():
+                    server._count('error')
+                    return self.respond(500, b'', head)
+
+                if api:
+                    server._count('api')
+                    body = json.dumps(server._api(api)).encode()
+                    return self.respond(200, body, head, 'application/json')
+
+                body = None if cdn is None else server._cdn(cdn)
+                if body is None:
+                    server._count('missing')
+                    return self.respond(404, b'', head)
+                server._count('head' if head else 'get')
+
+                range_ = re.match(r'bytes=(\d+)-$', self.headers.get('Range', ''))
+                if range_ is None:
+                    return self.respond(200, body, head)
+                start = int(range_.group(1))
+                if start >= len(body):
+                    return self.respond(416, b'', head,
+                        headers={'Content-Range': f'bytes */{len(body)}'})
+                return self.respond(206, body[start:], head,
+                    headers={'Content-Range': f'bytes {start}-{len(body)-1}/{len(body)}'})
+
+            def respond(self, status, body, head, content_type='application/octet-stream',
+                        headers=None):
+                self.send_response(status)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                for key, value in (headers or {}).items():
+                    self.send_header(key, value)
+                self.end_headers()
+                if not head:
+                    self.wfile.write(body)
+
+        return Handler
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        pass # clients closing keep-alive connections isn't an error
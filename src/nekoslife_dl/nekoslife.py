@@ -3,14 +3,38 @@ The main nekoslife file
 Contains NekosLife, the main class
 """
 import json
+import hashlib
 import os
 import threading
 import time
 import re
 from pprint import pprint
-from queue import Queue
+from queue import Empty
+from bisect import bisect_left
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from math import inf
 import requests
+from requests.adapters import HTTPAdapter
+try:
+    from urlstore import URLStore
+    from scheme import SchemeStore
+    from hashindex import HashIndex
+    from scheduler import RequestScheduler
+    from metrics import Metrics, RateMeter
+    from queues import PriorityDownloadQueue
+    from workers import DownloadWorkerPool
+    from thumbnails import ThumbnailCache
+    from checkpoint import Checkpoint
+except ImportError:
+    from .urlstore import URLStore
+    from .scheme import SchemeStore
+    from .hashindex import HashIndex
+    from .scheduler import RequestScheduler
+    from .metrics import Metrics, RateMeter
+    from .queues import PriorityDownloadQueue
+    from .workers import DownloadWorkerPool
+    from .thumbnails import ThumbnailCache
+    from .checkpoint import Checkpoint
 
 
 class NekosLife:
@@ -44,50 +68,134 @@ class NekosLife:
 
     PROGRESS_BAR = "\r[*] {d} / {u} images [{t} / {e}]"+' '*6
     start_dl_time = time.time()
-    estimated_time = 0
 
     # settings
     CHUNK_SIZE = 0x100000  # 1MibB
+    TIMEOUT = (10, 60)  # (connect, read) in seconds
+    POOL_HOSTS = 4  # api.nekos.dev and cdn.nekos.life, with some room
     ENDPOINT_TYPES = 'sfw', 'nsfw'
     ENDPOINT_FORMATS = 'img', 'gif'
     SHOW_PROGRESS_BAR = False
     SORT_URL_FILE = False
+    HARVEST_THREADS = 1
+    PROBE_THREADS = 8
+    WAIT_INTERVAL = 0.5  # longest a wait sleeps without checking for KeyboardInterrupt
+    DOWNLOAD_PRIORITY = PriorityDownloadQueue.BACKGROUND  # priority of urls added to dlqueue
+    THROUGHPUT_WINDOW = 30  # seconds of downloads the estimated time is based on
+    HASH_ALGORITHM = 'sha256'
+    ENDPOINTS_CACHE = os.path.join(os.path.expanduser('~'), '.cache', 'nekoslife-dl', 'endpoints.json')
+    ENDPOINTS_TTL = 24*60*60  # after this many seconds, cached endpoints are refreshed
+    DUPLICATES = 'record'
 
     # variables
-    dlqueue = Queue()
-    endpoints = {}
+    dlqueue = None
+    endpoints = None
 
     save_folder = None
     url_file = None
+    url_store = None
+    hash_index = None
+    thumbnails = None
+    checkpoint = None
+    session = None
 
     def __init__(self,
         save_folder: str = 'images', download_threads: int = 1,
         progress_bar: bool = False,
         url_file: str = None, sort_url_file: bool = False,
-        generate_endpoints: bool = False):
+        generate_endpoints: bool = False,
+        session: requests.Session = None, timeout=None,
+        harvest_threads: int = 1, probe_threads: int = 8,
+        scheme_file: str = None,
+        hash_index: str = None, duplicates: str = 'record',
+        rate_limit: float = None, retries: int = 5,
+        endpoints_cache=None, dlqueue=None,
+        min_download_threads: int = 1, max_download_threads: int = None,
+        thumbnail_sizes: tuple = None, thumbnail_folder: str = None,
+        checkpoint: Checkpoint = None):
         """
         `save_folder` is the path to downloaded images.
         `download_threads` initializes the set amount of `download workers`.
+        With `max_download_threads`, the amount is changed automatically \
+        between `min_download_threads` and it, see `DownloadWorkerPool`.
         `progress_bar` shows a progress bar for downloading (shows progress and estimated time).
         Essentially a quiet tag.
         `url_file` is used to store all gotten urls.
         You can use it without downloading and then later automatically add all the urls.
+        If it ends with one of `URLStore.EXTENSIONS`, an indexed `URLStore` is used instead,
+        which is much faster for big files.
         `sort_url_file` sorts the url file and prevents duplicates.
         `generate_endpoints` generates endpoints when initializing so you don'thave to wait later.
+        `session` is the transport used for every request, by default a pooled session
+        sized to `download_threads` is made. Pass your own to reuse or mock connections.
+        `timeout` is passed to every request, either seconds or `(connect, read)`.
+        `harvest_threads` is how many API requests `get_multiple_images` keeps in flight.
+        `probe_threads` is how many urls `autocomplete_urls` checks at once.
+        `scheme_file` saves the learned filename schemes of categories between runs.
+        `hash_index` is a database of the content hashes of downloaded files.
+        With it, `duplicates` decides what happens to a file with the same content as another:
+        `record` keeps it, `skip` deletes it and `hardlink` replaces it with a hardlink.
+        `rate_limit` is the maximum requests per second sent to each host, None for no limit.
+        `retries` is how many times a failed request is retried, see `RequestScheduler`.
+        `endpoints_cache` is the file endpoints are cached in, `ENDPOINTS_CACHE` by default.
+        Pass False to never cache them.
+        `dlqueue` is the queue downloads are taken from, a `PriorityDownloadQueue` by default.
+        Pass a `SQLiteQueue` to download together with other processes.
+        With `thumbnail_sizes`, download workers make thumbnails of every image they download, \
+        see `ThumbnailCache`. They're saved in `thumbnail_folder`, `{save_folder}.thumbnails` by default.
+        `checkpoint` records harvesting, autocomplete and the download queue, \
+        a loaded one continues where it stopped without asking the API or probing again.
         """
         self.save_folder = save_folder
+        self.dlqueue = PriorityDownloadQueue() if dlqueue is None else dlqueue
+        self.endpoints = {}
         self.url_file = url_file
+        if url_file is not None and url_file.endswith(URLStore.EXTENSIONS):
+            self.url_store = URLStore(url_file)
+        self._url_file_lock = threading.Lock()
+        self.HARVEST_THREADS = harvest_threads
+        self.PROBE_THREADS = probe_threads
+        self.schemes = SchemeStore(scheme_file)
+        if hash_index is not None:
+            if duplicates not in HashIndex.POLICIES:
+                raise ValueError('duplicates must be in [%s]' % ','.join(HashIndex.POLICIES))
+            self.hash_index = HashIndex(hash_index)
+            self.DUPLICATES = duplicates
+        if thumbnail_sizes:
+            if thumbnail_folder is None:
+                thumbnail_folder = os.path.normpath(save_folder)+'.thumbnails'
+            self.thumbnails = ThumbnailCache(thumbnail_folder, save_folder, thumbnail_sizes)
+
+        self.metrics = Metrics()
+        self._init_transport(session, rate_limit, retries,
+            max(download_threads, max_download_threads or 0, harvest_threads, probe_threads))
+        if timeout is not None:
+            self.TIMEOUT = timeout
 
         if not os.path.isdir(self.save_folder):
             os.makedirs(self.save_folder)
+        self._downloaded_lock = threading.Lock()
+        self.rescan_save_folder()
 
         self.SHOW_PROGRESS_BAR = progress_bar
         self.SORT_URL_FILE = sort_url_file
+        if endpoints_cache is not None:
+            self.ENDPOINTS_CACHE = endpoints_cache or None
 
         if generate_endpoints:
             self.get_endpoints()
 
-        self._start_download_workers(download_threads)
+        self._download_condition = threading.Condition()
+        self.download_callbacks = []
+        self.failed_urls = []
+        self._init_metrics()
+        self._start_download_workers(download_threads,
+            min(min_download_threads, download_threads), max_download_threads)
+
+        if checkpoint is not None:
+            self.checkpoint = checkpoint
+            checkpoint.dlqueue = self.dlqueue
+            self.add_to_dlqueue(checkpoint.queue)
 
     # =========================================================================
     # get images
@@ -96,17 +204,15 @@ class NekosLife:
         """
         Gets images from nekos.life, look at `get_endpoints()` to see all endpoints.
         Size of list is `amount`, `MAX_IMAGE_COUNT` by default.
-        Returns `(int)status_code` if status code is not 200.
+        Raises `requests.HTTPError` if the request still fails after all retries.
         """
         if amount == 0:
             amount = self.MAX_IMAGE_COUNT
-        elif amount == 0:
-            return 0
 
         url = self.generate_image_url(imgtype, imgformat, imgcategory, amount)
-        r = requests.get(url)
-        if r.status_code != 200:
-            return r.status_code
+        with self.metrics.histogram('nekoslife_api_seconds', 'API request latency').time():
+            r = self.request('GET', url)
+        r.raise_for_status()
 
         data = r.json()['data']
         if not data['status']['success']:
@@ -121,7 +227,8 @@ class NekosLife:
             add_to_dlqueue: bool = False,
             use_url_file=False,
             unique: int = 0, use_expected_unique: bool = False,
-            expected_unique_leeway: int = 0):
+            expected_unique_leeway: int = 0,
+            harvest_threads: int = None):
         """
         Gets multiple images than is allowed by the API.
         If `add_to_dlqueue` is True, starts adding all the urls to dlqueue.
@@ -131,28 +238,47 @@ class NekosLife:
         In case you just want to get ALL the images, use `use_expected_unique`.
         This will stop the program once the program gets \
         `maximum_images - expected_unique_leeway` images.
+        `harvest_threads` API requests are kept in flight, `HARVEST_THREADS` by default.
+        Urls are added to dlqueue as soon as their request finishes,
+        so the result may overshoot by the requests that were still in flight.
         """
-        if use_url_file:
-            urls = self.get_urls_file()
-            if add_to_dlqueue:
-                self.add_to_dlqueue(urls)
-
-            expected_unique = self.get_expected_unique(urls)
-        else:
-            urls = []
-            expected_unique = 0
+        for urls in self.iter_multiple_images(
+                imgtype, imgformat, imgcategory, amount,
+                add_to_dlqueue, use_url_file,
+                unique, use_expected_unique, expected_unique_leeway,
+                harvest_threads):
+            pass
+        return urls
 
-        if unique <= 0:
-            urls = set(urls)
+    def iter_multiple_images(self,
+            imgtype: str, imgformat: str, imgcategory: str, amount: int,
+            add_to_dlqueue: bool = False,
+            use_url_file=False,
+            unique: int = 0, use_expected_unique: bool = False,
+            expected_unique_leeway: int = 0,
+            harvest_threads: int = None):
+        """
+        Same as `get_multiple_images`, but yields all urls gotten so far after every API request.
+        The last yielded urls are the result.
+        Useful to get images from multiple categories at once, see `JobRunner`.
+        With a `checkpoint`, urls it already has aren't requested again.
+        """
+        category = f'{imgtype}/{imgformat}/{imgcategory}'
+        urls, expected_unique = self._start_getting(use_url_file, add_to_dlqueue, unique,
+            category=category)
 
-        for i in self._number_split(amount, self.MAX_IMAGE_COUNT):
-            new_urls = self.get_images(imgtype, imgformat, imgcategory, i)
+        state = None if self.checkpoint is None else self.checkpoint.get_harvest(category)
+        if state is not None:
+            new_urls = self._add_new_urls(urls, state['urls'], unique)
+            if add_to_dlqueue:
+                self.add_to_dlqueue(new_urls)
+            expected_unique = self.get_expected_unique(new_urls,expected_unique)
+            amount = 0 if state['done'] else max(amount-state['requested'], 0)
 
-            if unique <= 0:
-                new_urls = set(new_urls).difference(urls)
-                urls.update(new_urls)
-            else:
-                urls.extend(new_urls)
+        batches = self.iter_images(imgtype, imgformat, imgcategory, amount, harvest_threads)
+        for requested, batch in batches:
+            new_urls = self._add_new_urls(urls, batch, unique)
+            self.schemes.learn(new_urls)
 
             if add_to_dlqueue:
                 self.add_to_dlqueue(new_urls)
@@ -160,33 +286,146 @@ class NekosLife:
 
             expected_unique = self.get_expected_unique(new_urls,expected_unique)
 
-            if len(urls) >= unique >= 0:
-                break
-            
-            elif (use_expected_unique and \
-                  len(urls) >= expected_unique - expected_unique_leeway
-            ):
+            finished = self._finished_getting(urls, unique,
+                use_expected_unique, expected_unique, expected_unique_leeway)
+            if self.checkpoint is not None:
+                self.checkpoint.update_harvest(category, new_urls, requested, finished)
+            if finished:
                 break
-                
+            yield urls
+        batches.close()
+        self.schemes.save()
+        if self.checkpoint is not None:
+            self.checkpoint.update_harvest(category, done=True)
 
         if use_url_file:
             self.add_urls_file(set(urls))
 
-        return urls
+        yield urls
+
+    def iter_images(self, imgtype: str, imgformat: str, imgcategory: str, amount: int,
+            harvest_threads: int = None):
+        """
+        Yields `(requested, urls)` of every `get_images` call, until `amount` urls have been requested.
+        The API can give less urls than `requested`.
+        Keeps `harvest_threads` requests in flight and yields them as they finish.
+        Closing the generator cancels the requests that haven't started yet.
+        """
+        if harvest_threads is None:
+            harvest_threads = self.HARVEST_THREADS
+
+        amounts = self._number_split(amount, self.MAX_IMAGE_COUNT)
+        if harvest_threads <= 1:
+            for i in amounts:
+                yield i, self.get_images(imgtype, imgformat, imgcategory, i)
+            return
+
+        executor = ThreadPoolExecutor(harvest_threads, thread_name_prefix='nlharvester')
+        pending = {} # future -> requested
+        try:
+            while True:
+                for i in amounts:
+                    future = executor.submit(self.get_images, imgtype, imgformat, imgcategory, i)
+                    pending[future] = i
+                    if len(pending) >= harvest_threads:
+                        break
+                if not pending:
+                    return
+
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield pending.pop(future), future.result()
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def _start_getting(self, use_url_file, add_to_dlqueue, unique, category=None):
+        """
+        Prepares `get_multiple_images`, returns `(urls, expected_unique)`.
+        Should only be used internally.
+        """
+        if use_url_file:
+            urls = self.get_urls_file(category)
+            if add_to_dlqueue:
+                self.add_to_dlqueue(urls)
+
+            expected_unique = self.get_expected_unique(urls)
+        else:
+            urls = []
+            expected_unique = 0
+
+        if unique <= 0:
+            urls = set(urls)
+
+        return urls, expected_unique
+
+    @staticmethod
+    def _add_new_urls(urls, new_urls, unique):
+        """
+        Adds `new_urls` into `urls`, returns the urls that were actually added.
+        Should only be used internally.
+        """
+        if unique <= 0:
+            new_urls = set(new_urls).difference(urls)
+            urls.update(new_urls)
+        else:
+            urls.extend(new_urls)
+        return new_urls
+
+    @staticmethod
+    def _finished_getting(urls, unique,
+            use_expected_unique, expected_unique, expected_unique_leeway):
+        """
+        Checks whether `get_multiple_images` has gotten enough urls.
+        Should only be used internally.
+        """
+        if len(urls) >= unique >= 0:
+            return True
+        elif (use_expected_unique and \
+              len(urls) >= expected_unique - expected_unique_leeway
+        ):
+            return True
+        return False
 
     # =========================================================================
     # download
 
-    def add_to_dlqueue(self, urls):
+    def add_to_dlqueue(self, urls, priority=None):
         """
         Adds urls to `dlqueue`.
         Uses methods `should_enqueue(url_to_imagedata(url))` to check url validity.
         If you want to guarantee that there's no copies, pass in a set.
+        `priority` is one of `PriorityDownloadQueue.PRIORITIES`, `DOWNLOAD_PRIORITY` by default.
+        It's ignored by queues without priorities.
         """
+        if priority is None:
+            priority = self.DOWNLOAD_PRIORITY
+        has_priorities = isinstance(self.dlqueue, PriorityDownloadQueue)
         for url in urls:
             urldata = self.url_to_imagedata(url)
             if self.should_enqueue(*urldata):
-                self.dlqueue.put(urldata)
+                if has_priorities:
+                    self.dlqueue.put(urldata, priority=priority)
+                else:
+                    self.dlqueue.put(urldata)
+
+    def prioritize_downloads(self, priority, urls=None, category=None):
+        """
+        Moves queued urls to another priority, all of a `type/format/category` \
+        if `urls` aren't given. Returns how many urls were moved.
+        Needs a `PriorityDownloadQueue`.
+        """
+        return self.dlqueue.reprioritize(priority, urls, category)
+
+    def cancel_downloads(self, urls=None, category=None):
+        """
+        Removes queued urls that haven't started downloading yet, all of a \
+        `type/format/category` or everything if neither is given.
+        Returns how many urls were removed. Needs a `PriorityDownloadQueue`.
+        """
+        cancelled = self.dlqueue.cancel(urls, category)
+        with self._download_condition:
+            self._download_condition.notify_all()
+        return cancelled
 
     def url_to_imagedata(self, url):
         """
@@ -200,9 +439,12 @@ class NekosLife:
     def should_enqueue(self, url, path, filename):
         """
         Checks wheter a url should be enqueued.
-        Valid if file does not exist.
+        Valid if file is not in `downloaded` and wasn't skipped as a duplicate.
         """
-        if os.path.exists(path):
+        if filename in self.downloaded:
+            return False
+        if (self.DUPLICATES == 'skip' and self.hash_index is not None
+            and self.hash_index.is_duplicate(filename)):
             return False
         return True
 
@@ -210,28 +452,74 @@ class NekosLife:
         """
         Waits until all downloads are finished.
         Returns True when everything was downloaded.
-        If you want no timeout, `dlqueue.join()` is better, but it doesn't allow KeyboardInterrupt.
+        Unlike `dlqueue.join()`, this allows KeyboardInterrupt.
         """
-        start = time.time()
-        while self.dlqueue.unfinished_tasks:
-            if time.time() - start > timeout:
-                return False
+        return self.wait_for_download(lambda: not self.dlqueue.unfinished_tasks, timeout)
+
+    def wait_for_download(self, predicate, timeout=None):
+        """
+        Blocks until `predicate()` is True, checking it again after every finished download.
+        Returns False if `timeout` seconds pass first, waits forever if it's None.
+        """
+        end = None if timeout is None else time.time() + timeout
+        with self._download_condition:
+            while not predicate():
+                wait = self.WAIT_INTERVAL
+                if end is not None:
+                    wait = min(wait, end - time.time())
+                    if wait <= 0:
+                        return False
+                self._download_condition.wait(wait)
 
         return True
 
+    def add_download_callback(self, callback):
+        """
+        Calls `callback(url, path, filename, success)` every time a download worker \
+        finishes an item. It's called from the worker thread, so keep it short.
+        """
+        self.download_callbacks.append(callback)
+
+    def _notify_download(self, url, path, filename, success):
+        """
+        Runs the download callbacks and wakes up everything waiting for a download.
+        Should only be used internally.
+        """
+        for callback in self.download_callbacks:
+            callback(url, path, filename, success)
+        with self._download_condition:
+            self._download_condition.notify_all()
+
     # =========================================================================
     # autocomplete
     def check_real_url(self,url) -> bool:
         """
         Checks if the status code is 200.
         """
-        return requests.head(url).status_code == 200
+        return self.request('HEAD', url).status_code == 200
 
-    def check_file_extensions(self,url_format,index,zeros):
+    def check_file_extensions(self,url_format,index,zeros,extensions=None):
         """
         Goes through possible img file extensions, returns the real one.
+        `extensions` are tried first, in order, then the rest of `IMG_EXTENSIONS`.
         Returns None if none is real.
         """
+        return self.check_urls(self._extension_candidates(url_format,index,zeros,extensions))
+
+    def check_urls(self,urls):
+        """
+        Returns the first real url, None if none is real.
+        """
+        for url in urls:
+            if self.check_real_url(url):
+                return url
+        return None
+
+    def _extension_candidates(self,url_format,index,zeros,extensions=None):
+        """
+        Makes urls with the index of `url_format` replaced by `index`, one for each extension.
+        Should only be used internally.
+        """
         url,filename = os.path.split(url_format)
         filename = filename.split('_')[0]
         
@@ -243,38 +531,60 @@ class NekosLife:
         filename += f'_{index}.'
         url = url+'/'+filename
         
-        for e in self.IMG_EXTENSIONS:
-            check = url+e
-            if self.check_real_url(check):
-                return check
-        return None
+        if extensions is None:
+            extensions = ()
+        extensions = dict.fromkeys((*extensions, *self.IMG_EXTENSIONS))
+        return [url+e for e in extensions]
+
+    @staticmethod
+    def _url_extension(url):
+        return os.path.splitext(url)[1][1:]
 
-    def should_autocomplete(self,url,expected_index,zeros):
+    def _neighbour_extensions(self,known,indexes,index):
         """
-        Looks at a url and expected index, then returns based off what should be there.
-        Returns (str)url if should autocomplete, \
-        None if there's no url avalible and empty string if no url needs to be returned.
-        `zeros` is how many zeros should be in the image
+        Gets the extensions of the closest known urls under and over `index`.
+        `indexes` are the sorted keys of `known`.
+        Should only be used internally.
         """
-        if not self.matches_regex(url):
-            return None # url doesn't match regex, so stop looking
-        
-        index = self.url_index(url)
+        i = bisect_left(indexes,index)
+        return [self._url_extension(known[indexes[j]]) for j in (i-1,i) if 0 <= j < len(indexes)]
+
+    def _find_last_index(self,probe,start):
+        """
+        Finds the last index over `start` for which `probe(index)` isn't None.
+        Doubles the step until a probe misses, then binary searches between the last hit and the miss.
+        Assumes there are no gaps over `start`.
+        Returns `(last_index, {index: url})` with the urls that were found on the way.
+        Should only be used internally.
+        """
+        found = {}
+        low,step = start,1
+        while True:
+            url = probe(start+step)
+            if url is None:
+                high = start+step
+                break
+            low = start+step
+            found[low] = url
+            step *= 2
         
-        if index != expected_index:
-            url = self.check_file_extensions(url,expected_index,zeros)
+        while high-low > 1:
+            middle = (low+high)//2
+            url = probe(middle)
             if url is None:
-                return None
+                high = middle
             else:
-                return url
-        else:
-            return ''
+                low = middle
+                found[low] = url
+        
+        return low,found
 
     def autocomplete_urls(self,
             urls,
             sort=True,check_over=True,
             add_to_dlqueue=False,
-            use_url_file=False,update_file_every_url=False):
+            use_url_file=False,update_file_every_url=False,
+            probe_threads=None, shard=None):
         """
         Enter an array of urls. If the images end in numbers, will return the complete url array.
         There must not be any copies, so entering a set is preffered.
@@ -283,45 +593,92 @@ class NekosLife:
         `add_to_dlqueue`  starts adding all the urls to dlqueue.
         If `use_url_file`, undownloaded urls will be downloaded and at the end of getting saved.
         `update_file_every_url` saves url to file EVERY url, can cause performance issues.
+        `probe_threads` indexes are checked at once, `PROBE_THREADS` by default.
+        Urls are made from the learned `FilenameScheme` of the category, trying the extension \
+        of neighbouring urls first and skipping extensions the category never uses.
+        Missing indexes are skipped.
+        The highest index is found with an exponential, then binary search, \
+        starting from the highest index the scheme has ever seen.
+        With a `shard`, only missing indexes it owns are checked, \
+        so several processes can autocomplete the same category together.
+        With a `checkpoint`, indexes it already checked aren't checked again.
         """
+        if probe_threads is None:
+            probe_threads = self.PROBE_THREADS
         if sort:
             urls = sorted(set(urls), key=self.url_index)
+        urls = [url for url in urls if self.matches_regex(url)]
+        if not urls:
+            return urls
         
         image_amount = self.url_index(urls[-1])
         if image_amount == 0:
             return urls
         
-        zeros = sum(i.isdigit() for i in os.path.split(urls[0])[1])
-        
-        index = 0
-        while index < image_amount:
-            # the expected index is one more, since images start from 1
-            url = self.should_autocomplete(urls[index],index+1,zeros)
+        self.schemes.learn(urls)
+        category = URLStore.url_category(urls[0])
+        scheme = self.schemes.get(category)
+        known = {self.url_index(url): url for url in urls}
+        given = len(urls)
+
+        state = {'cursor': 0, 'last_index': None, 'found': []}
+        if self.checkpoint is not None:
+            state = self.checkpoint.get_autocomplete(category)
+            for url in state['found']:
+                if self.url_index(url) not in known:
+                    known[self.url_index(url)] = url
+                    urls.append(url)
+            if add_to_dlqueue:
+                self.add_to_dlqueue(state['found'])
+        indexes = sorted(known)
+
+        probes = self.metrics.counter('nekoslife_probes_total',
+            'Indexes checked by autocomplete, by whether an image was there')
+
+        def probe(index):
+            preferred = self._neighbour_extensions(known,indexes,index)
+            url = self.check_urls(scheme.candidates(index,preferred,self.IMG_EXTENSIONS))
+            probes.inc(result='miss' if url is None else 'hit')
+            return url
+
+        def owned(indexes):
+            return [i for i in indexes if shard is None or shard.owns(i)]
+
+        def found(url):
+            if add_to_dlqueue:
+                self.add_to_dlqueue([url])
+            if update_file_every_url:
+                self.add_urls_file([url])
+            urls.append(url)
+
+        def probe_all(missing):
+            missing = [i for i in owned(missing) if i > state['cursor']]
+            for index,url in zip(missing, executor.map(probe, missing)):
+                if url is not None:
+                    found(url)
+                if self.checkpoint is not None:
+                    self.checkpoint.update_autocomplete(category, index, [url] if url else ())
+
+        with ThreadPoolExecutor(probe_threads, thread_name_prefix='nlprober') as executor:
+            probe_all(i for i in range(1, image_amount+1) if i not in known)
             
-            if url is None:
-                return urls # no more images
-            elif url:
-                if add_to_dlqueue:
-                    self.add_to_dlqueue([url])
-                if update_file_every_url:
-                    self.add_urls_file([url])
-                urls.insert(index,url) # insert the new url in the correct position
-
-            index += 1
-        
-        index += 1
-        # check for more over the max
-        while check_over:
-            url = self.check_file_extensions(urls[0],index,zeros)
-            if url is None:
-                break
-            else:
-                if add_to_dlqueue:
-                    self.add_to_dlqueue([url])
-                if update_file_every_url:
-                    self.add_urls_file([url])
-                urls.append(url)
-            index += 1
+            # check for more over the max
+            if check_over:
+                last_index = state['last_index']
+                if last_index is None:
+                    start = max(image_amount, scheme.high)
+                    last_index,over = self._find_last_index(probe,start)
+                    for url in over.values():
+                        found(url)
+                        known[self.url_index(url)] = url
+                    if self.checkpoint is not None:
+                        self.checkpoint.update_autocomplete(category,
+                            found=over.values(), last_index=last_index)
+                probe_all(i for i in range(image_amount+1, last_index+1) if i not in known)
+
+        self.schemes.learn(urls[given:])
+        self.schemes.save()
+        urls.sort(key=self.url_index)
 
         if use_url_file and not update_file_every_url:
             self.add_urls_file(urls)
@@ -331,62 +688,220 @@ class NekosLife:
     # =========================================================================
     # download workers
 
-    def download_url(self, url, path, dlpath=None, special_filename=None):
+    def download_url(self, url, path, dlpath=None, special_filename=None, digest=None):
         """
         Downloads a file and saves it to path.
+        The file is streamed in `CHUNK_SIZE` chunks, so it's never fully in memory.
         Dlpath will be the file path while still downloading.
-        Returns how long the download took. 0 if failed.
+        If dlpath already exists, the download is resumed with a Range request,
+        when the server ignores the range the download starts from zero.
+        `digest` is a hashlib object, which gets updated with the whole file while streaming.
+        Returns how long the download took.
         `special_filename` has no usage currently.
         """
         start = time.time()
-        r = requests.get(url)
         if dlpath is None:
             dlpath = path
-        with open(dlpath, 'wb') as file:
-            for chunk in r.iter_content(self.CHUNK_SIZE):
-                file.write(chunk)
+
+        resume_from = 0
+        if dlpath != path and os.path.isfile(dlpath):
+            resume_from = os.path.getsize(dlpath)
+        headers = {'Range': f'bytes={resume_from}-'} if resume_from else {}
+
+        with self.request('GET', url, headers=headers, stream=True) as r:
+            resumed = r.status_code == 206
+            if (r.status_code == 416 or resumed and
+                not r.headers.get('Content-Range', '').startswith(f'bytes {resume_from}-')):
+                # the partial file doesn't fit the real file anymore
+                os.remove(dlpath)
+                return self.download_url(url, path, dlpath, special_filename, digest)
+            r.raise_for_status()
+
+            if resumed and digest is not None:
+                self._hash_file(dlpath, digest)
+            with open(dlpath, 'ab' if resumed else 'wb') as file:
+                for chunk in r.iter_content(self.CHUNK_SIZE):
+                    file.write(chunk)
+                    if digest is not None:
+                        digest.update(chunk)
+                    self._count_bytes(len(chunk))
         os.rename(dlpath, path)
 
         return time.time() - start
 
-    def download_worker(self):
+    def download_bytes(self, url, digest=None):
+        """
+        Downloads a file into memory and returns its content, nothing is written to disk.
+        `digest` is a hashlib object, which gets updated with the whole file.
+        """
+        data = bytearray()
+        with self.request('GET', url, stream=True) as r:
+            r.raise_for_status()
+            for chunk in r.iter_content(self.CHUNK_SIZE):
+                data += chunk
+                if digest is not None:
+                    digest.update(chunk)
+                self._count_bytes(len(chunk))
+        return bytes(data)
+
+    def download_worker(self, stopped=None):
         """
-        Gets urls from `dlqueue` and downloads them.
+        Gets urls from `dlqueue` and downloads them, until `stopped()` is True.
         Updates the estimated time and prints progress bar every download.
+        Interrupted downloads are kept as `.000` files and resumed next time.
+        Urls that failed even after retrying are added to `failed_urls`.
         """
-        while True:
-            url, path, filename = self.dlqueue.get()
+        while stopped is None or not stopped():
+            try:
+                url, path, filename = self.dlqueue.get(timeout=self.WAIT_INTERVAL)
+            except Empty:
+                continue
 
+            success = False
             try:
                 dlpath = path+'.000'
-                dl_time = self.download_url(url, path, dlpath, filename)
+                digest = None
+                if self.hash_index is not None:
+                    digest = hashlib.new(self.HASH_ALGORITHM)
+                dl_time = self.download_url(url, path, dlpath, filename, digest)
+                original = None
+                if digest is not None:
+                    original = self.deduplicate(path, filename, digest.hexdigest())
+                if original is None or self.DUPLICATES != 'skip':
+                    self.make_thumbnails(filename)
+                    self.add_downloaded(filename)
                 self.update_estimated_time(dl_time)
+                result = 'downloaded' if original is None else 'duplicate'
+                success = True
+            except requests.HTTPError as e:
+                status = None if e.response is None else e.response.status_code
+                if self.is_bad_url_status(status) and os.path.isfile(dlpath):
+                    os.remove(dlpath) # the url itself is bad, nothing to resume
+                self.failed_urls.append(url)
+                result = 'failed'
             except (Exception, KeyboardInterrupt):
-                if os.path.isfile(dlpath):
-                    os.remove(dlpath)
+                self.failed_urls.append(url)
+                result = 'failed'
+            self.metrics.counter('nekoslife_downloads_total',
+                'Finished downloads, by result').inc(result=result)
 
             self.print_progress_bar()
-            self.dlqueue.task_done()
+            if not success and hasattr(self.dlqueue, 'task_failed'):
+                self.dlqueue.task_failed() # so it's downloaded again next time
+            else:
+                self.dlqueue.task_done()
+            self._notify_download(url, path, filename, success)
+
+    @staticmethod
+    def is_bad_url_status(status) -> bool:
+        """
+        Whether a failed download's status means the url itself is bad, \
+        so its partial file can be deleted. 429 and 5xx are temporary, the file is kept to resume.
+        """
+        return status is not None and 400 <= status < 500 and status != 429
 
-    def _start_download_workers(self, amount):
+    def make_thumbnails(self, filename):
+        """
+        Makes the thumbnails of a just downloaded file, while it's still in the disk cache.
+        A file that isn't an image doesn't fail the download, it just doesn't get thumbnails.
         """
-        Starts a set amount of download workers.
-        Remember to run this function only once.
+        if self.thumbnails is None:
+            return
+        try:
+            self.thumbnails.add(filename)
+            result = 'made'
+        except Exception:
+            result = 'failed'
+        self.metrics.counter('nekoslife_thumbnails_total',
+            'Downloaded images thumbnails were made for, by result').inc(result=result)
+
+    def get_thumbnail(self, filename, width, height=None):
         """
-        self._download_workers = []
-        for i in range(amount):
-            t = threading.Thread(target=self.download_worker,
-                                 name=f'nldlworker_{i}', daemon=True)
-            t.start()
-            self._download_workers.append(t)
+        Returns the path of the smallest thumbnail of a downloaded file that's at least \
+        `width`x`height`, see `ThumbnailCache.get`.
+        None if there are no thumbnails or none is big enough, then use the file itself.
+        """
+        if self.thumbnails is None:
+            return None
+        return self.thumbnails.get(filename, width, height)
+
+    def deduplicate(self, path, filename, digest):
+        """
+        Records the hash of a downloaded file in `hash_index` and applies `DUPLICATES` to it.
+        Returns the path of the original if the file is a duplicate, None otherwise.
+        A file that can't be hardlinked, because the original is gone or on another filesystem, \
+        is kept as it is.
+        """
+        original = self.hash_index.add(filename, digest, path)
+        if original is None:
+            return None
+
+        if self.DUPLICATES == 'skip':
+            os.remove(path)
+        elif self.DUPLICATES == 'hardlink':
+            # linked next to it first, so the file is only replaced once the link worked
+            temp = path+'.link'
+            try:
+                if os.path.lexists(temp):
+                    os.remove(temp)
+                os.link(original, temp)
+                os.replace(temp, path)
+            except OSError:
+                if os.path.lexists(temp):
+                    os.remove(temp)
+        return original
+
+    def _hash_file(self, path, digest):
+        """
+        Updates a hashlib object with the content of a file.
+        Should only be used internally.
+        """
+        with open(path, 'rb') as file:
+            for chunk in iter(lambda: file.read(self.CHUNK_SIZE), b''):
+                digest.update(chunk)
+
+    def _start_download_workers(self, amount, min_amount=1, max_amount=None):
+        """
+        Starts the pool of download workers, it autoscales when there's a `max_amount`.
+        Change its size later with `resize_download_workers`.
+        """
+        workers = self.metrics.gauge('nekoslife_download_workers', 'Running download workers')
+        self.download_workers = DownloadWorkerPool(self.download_worker, amount,
+            min_size = min_amount,
+            max_size = max_amount,
+            autoscale = max_amount is not None,
+            stats = self._download_stats,
+            backlog = self.dlqueue.qsize,
+            on_resize = workers.set)
+
+    def resize_download_workers(self, amount):
+        """
+        Changes the amount of download workers, returns the new amount.
+        Stopped workers finish their current download first.
+        """
+        return self.download_workers.resize(amount)
+
+    def _download_stats(self):
+        """
+        Returns `(downloaded, failed, bytes)` so far, used for autoscaling.
+        Should only be used internally.
+        """
+        downloads = self.metrics.counter('nekoslife_downloads_total')
+        return (downloads.get(result='downloaded') + downloads.get(result='duplicate'),
+                downloads.get(result='failed'),
+                self.metrics.counter('nekoslife_downloaded_bytes_total').get())
 
     # =========================================================================
     # url file
 
-    def get_urls_file(self):
+    def get_urls_file(self, category=None):
         """
         Gets all urls from `url_file`. Urls must be seperated by `\\n`.
+        With a `url_store`, only gets urls of `category` (`type/format/category`) if given.
         """
+        if self.url_store is not None:
+            return self.url_store.get_urls(category)
+
         if self.url_file is None or not os.path.isfile(self.url_file):
             return []
 
@@ -402,6 +917,10 @@ class NekosLife:
         """
         Sets the content of the `url_file` into urls.
         """
+        if self.url_store is not None:
+            self.url_store.set_urls(urls)
+            return urls
+
         if self.url_file is None:
             return []
 
@@ -414,8 +933,52 @@ class NekosLife:
     def add_urls_file(self, urls):
         """
         Adds urls into `url_file`.
+        A `url_store` only appends the new urls instead of rewriting everything.
+        """
+        if self.url_store is not None:
+            return self.url_store.add_urls(urls)
+
+        with self._url_file_lock:
+            return self.set_urls_file(set(urls).union(self.get_urls_file()))
+
+    # =========================================================================
+    # downloaded files
+
+    def rescan_save_folder(self):
+        """
+        Rebuilds `downloaded`, the filenames of all finished files in `save_folder`.
+        Only needed when files were added or removed by something else.
+        """
+        downloaded = set()
+        with os.scandir(self.save_folder) as entries:
+            for entry in entries:
+                if entry.is_file() and not entry.name.endswith('.000'):
+                    downloaded.add(entry.name)
+
+        with self._downloaded_lock:
+            self.downloaded = downloaded
+        return downloaded
+
+    def add_downloaded(self, filename):
+        """
+        Marks a file in `save_folder` as downloaded.
+        """
+        with self._downloaded_lock:
+            self.downloaded.add(filename)
+
+    def remove_downloaded(self, filename):
+        """
+        Marks a file as no longer in `save_folder`, use after moving or deleting it.
+        """
+        with self._downloaded_lock:
+            self.downloaded.discard(filename)
+
+    def get_downloaded(self):
+        """
+        Returns a list of all downloaded filenames.
         """
-        return self.set_urls_file(set(urls).union(self.get_urls_file()))
+        with self._downloaded_lock:
+            return list(self.downloaded)
 
     # =========================================================================
     # progress bar
@@ -429,11 +992,11 @@ class NekosLife:
         if not self.SHOW_PROGRESS_BAR:
             return False
 
-        downloaded_urls = len(os.listdir(self.save_folder))
+        downloaded_urls = len(self.downloaded)
         planned_urls = self.dlqueue.qsize()
         urls = downloaded_urls + planned_urls
         current_time = round(time.time()-self.start_dl_time, 2)
-        estimated_time = round(current_time+self.estimated_time*planned_urls, 2)
+        estimated_time = round(current_time+self.get_remaining_time(planned_urls), 2)
 
         print(
             self.PROGRESS_BAR.format(
@@ -445,14 +1008,48 @@ class NekosLife:
 
     def update_estimated_time(self, time):
         """
-        Updates estimated time of seconds per image.
+        Records a finished download that took `time` seconds.
         Should only be used internally.
         """
-        if self.estimated_time is None:
-            self.estimated_time = time
-        else:
-            urls = len(os.listdir(self.save_folder))
-            self.estimated_time = (urls*self.estimated_time+time)/(urls+1)
+        self._throughput.add()
+        self.metrics.histogram('nekoslife_download_seconds', 'Download latency').observe(time)
+
+    def get_remaining_time(self, planned_urls):
+        """
+        Estimates the seconds until `planned_urls` more images are downloaded, \
+        from how many images were downloaded in the last `THROUGHPUT_WINDOW` seconds.
+        Unlike the average time per image, this counts downloads running at the same time.
+        """
+        rate = self._throughput.rate()
+        return planned_urls/rate if rate else 0
+
+    # =========================================================================
+    # metrics
+
+    def _init_metrics(self):
+        """
+        Makes the throughput meters and the gauges that are read when exported.
+        Should only be used internally.
+        """
+        self._throughput = RateMeter(self.THROUGHPUT_WINDOW)
+        self._byte_throughput = RateMeter(self.THROUGHPUT_WINDOW)
+        self.metrics.gauge('nekoslife_queue_depth', 'Urls waiting to be downloaded',
+            lambda: 0 if self.dlqueue is None else self.dlqueue.qsize())
+        self.metrics.gauge('nekoslife_images_per_second', 'Download throughput',
+            self._throughput.rate)
+        self.metrics.gauge('nekoslife_bytes_per_second', 'Download throughput in bytes',
+            self._byte_throughput.rate)
+        if getattr(self, 'scheduler', None) is not None:
+            self.metrics.gauge('nekoslife_hosts_paused', 'Hosts paused by their circuit breaker',
+                lambda: sum(b.is_open for b in list(self.scheduler.breakers.values())))
+
+    def _count_bytes(self, amount):
+        """
+        Records downloaded bytes.
+        Should only be used internally.
+        """
+        self._byte_throughput.add(amount)
+        self.metrics.counter('nekoslife_downloaded_bytes_total', 'Bytes downloaded').inc(amount)
 
     def get_expected_unique(self,urls,old_max=0):
         m = old_max
@@ -506,6 +1103,62 @@ class NekosLife:
             yield s
         yield n-i
 
+    # =========================================================================
+    # transport
+
+    def create_session(self, pool_size=1):
+        """
+        Creates a keep-alive session with a connection pool for each host.
+        `pool_size` is how many connections are kept per host, \
+        usually the amount of download workers.
+        """
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=self.POOL_HOSTS,
+                              pool_maxsize=max(pool_size, 1))
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        return session
+
+    def _init_transport(self, session, rate_limit, retries, pool_size):
+        """
+        Makes `session`, unless one was given, and the `scheduler` every request goes through.
+        Should only be used internally.
+        """
+        if session is None:
+            session = self.create_session(pool_size)
+        self.session = session
+        self.scheduler = RequestScheduler(session, rate=rate_limit, retries=retries,
+                                          metrics=self.metrics)
+
+    def request(self, method, url, **kwargs):
+        """
+        Sends a request through `session`, rate limited and retried by `scheduler`.
+        Every network call goes through here, so it's the place to hook into.
+        """
+        kwargs.setdefault('timeout', self.TIMEOUT)
+        try:
+            with self.metrics.histogram('nekoslife_request_seconds',
+                    'Latency of every request, with retries').time(method=method):
+                r = self.scheduler.request(method, url, **kwargs)
+        except requests.RequestException as e:
+            self.metrics.counter('nekoslife_request_errors_total',
+                'Requests that failed without a response').inc(method=method, error=type(e).__name__)
+            raise
+        self.metrics.counter('nekoslife_responses_total',
+            'Responses, by status').inc(method=method, status=r.status_code)
+        return r
+
+    def close(self, timeout=None):
+        """
+        Stops the download workers once their current download is finished, \
+        waiting at most `timeout` seconds, then closes all pooled connections.
+        Urls that are still queued stay in `dlqueue`.
+        Returns False if some download didn't finish in time.
+        """
+        stopped = self.download_workers.shutdown(timeout=timeout)
+        self.session.close()
+        return stopped
+
     # =========================================================================
     # utility
 
@@ -531,26 +1184,74 @@ class NekosLife:
         """
         Gets all endpoints by requesting bad urls and getting corrected.
         If endpoints have been already once generated, returns the old endpoints.
+        Otherwise they're read from `ENDPOINTS_CACHE`, if the cache is older than `ENDPOINTS_TTL`,
+        it's still used but gets refreshed in the background.
         To overcome this use `force`.
         """
         if self.endpoints and not force:
             return self.endpoints
 
-        endpoints = {}
-        for i in self.ENDPOINT_TYPES:
-            endpoints[i] = {}
-            for j in self.ENDPOINT_FORMATS:
-                url = self.IMAGES_URL+i+'/'+j+'/'
-                data = requests.get(url).json()['data']
-                endpoints[i][j] = data['response']['categories']
+        if not force:
+            endpoints, age = self._load_endpoints_cache()
+            if endpoints is not None:
+                self.endpoints = endpoints
+                if age > self.ENDPOINTS_TTL:
+                    threading.Thread(target=self.get_endpoints, args=(True,),
+                                     name='nlendpoints', daemon=True).start()
+                return endpoints
+
+        pairs = [(i, j) for i in self.ENDPOINT_TYPES for j in self.ENDPOINT_FORMATS]
+        with ThreadPoolExecutor(len(pairs), thread_name_prefix='nlendpoints') as executor:
+            responses = executor.map(
+                lambda pair: self.request('GET', self.IMAGES_URL+pair[0]+'/'+pair[1]+'/'), pairs)
+
+            endpoints = {i: {} for i in self.ENDPOINT_TYPES}
+            for (i, j), r in zip(pairs, responses):
+                endpoints[i][j] = r.json()['data']['response']['categories']
 
         self.endpoints = endpoints
+        self._save_endpoints_cache(endpoints)
 
         return endpoints
 
-    def raise_for_category(self, imgtype, imgformat, imgcategory):
+    def _load_endpoints_cache(self):
+        """
+        Reads `ENDPOINTS_CACHE`, returns `(endpoints, age_in_seconds)`.
+        Endpoints are None if there is no usable cache.
+        Should only be used internally.
+        """
+        if self.ENDPOINTS_CACHE is None or not os.path.isfile(self.ENDPOINTS_CACHE):
+            return None, inf
+        try:
+            with open(self.ENDPOINTS_CACHE, 'r') as file:
+                cache = json.load(file)
+        except (OSError, ValueError):
+            return None, inf
+
+        if cache.get('url') != self.IMAGES_URL:
+            return None, inf
+        return cache['endpoints'], time.time() - cache['time']
+
+    def _save_endpoints_cache(self, endpoints):
+        """
+        Writes endpoints into `ENDPOINTS_CACHE`.
+        Should only be used internally.
+        """
+        if self.ENDPOINTS_CACHE is None:
+            return
+        folder = os.path.dirname(self.ENDPOINTS_CACHE)
+        if folder and not os.path.isdir(folder):
+            os.makedirs(folder)
+
+        temp = self.ENDPOINTS_CACHE+'.000'
+        with open(temp, 'w') as file:
+            json.dump({'url': self.IMAGES_URL, 'time': time.time(), 'endpoints': endpoints}, file)
+        os.replace(temp, self.ENDPOINTS_CACHE)
+
+    def raise_for_category(self, imgtype, imgformat, imgcategory, endpoints=None):
         """
         Raises ValueError if category is invalid.
+        `endpoints` are the already gotten endpoints, `get_endpoints()` by default.
         """
         if imgtype not in self.ENDPOINT_TYPES:
             raise ValueError('type must be in [%s]'
@@ -559,7 +1260,9 @@ class NekosLife:
             raise ValueError('format must be in [%s]'
                              % ','.join(self.ENDPOINT_FORMATS))
 
-        endpoints = self.get_endpoints()[imgtype][imgformat]
+        if endpoints is None:
+            endpoints = self.get_endpoints()
+        endpoints = endpoints[imgtype][imgformat]
         if imgcategory not in endpoints:
             raise ValueError(f'category for {imgtype}/{imgformat} must be in [%s]'
                              % ','.join(endpoints))
@@ -568,9 +1271,17 @@ class NekosLife:
         """
         Marks all unstarted tasks as done.
         """
-        while not self.dlqueue.empty():
-            self.dlqueue.get()
+        if isinstance(self.dlqueue, PriorityDownloadQueue):
+            self.cancel_downloads()
+            return
+        while True:
+            try:
+                self.dlqueue.get_nowait()
+            except Empty:
+                break
             self.dlqueue.task_done()
+        with self._download_condition:
+            self._download_condition.notify_all()
     
     def matches_regex(self,url):
         return bool(re.match(self.PROPER_IMAGE_REGEX,url))
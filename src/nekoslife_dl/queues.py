@@ -0,0 +1,431 @@
+"""
+The queues file
+Contains PriorityDownloadQueue, the default download queue,
+and SQLiteQueue, a download queue that can be shared by several processes
+"""
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from queue import Empty
+try:
+    from urlstore import URLStore
+except ImportError:
+    from .urlstore import URLStore
+
+
+class PriorityDownloadQueue:
+    """
+    A download queue of `(url, path, filename)` with priorities, works like a `queue.Queue`.
+    Urls with a higher priority (`URGENT`, then `INTERACTIVE`, then `BACKGROUND`) are always
+    taken first. Within a priority, categories take turns, so a big batch of one category
+    doesn't hold back the others.
+    A url is only queued once, putting it again can only raise its priority.
+    Putting a url that's being downloaded does nothing, until its `task_done`.
+    Queued urls can be moved to another priority with `reprioritize` or removed with `cancel`.
+    ```
+    dlqueue = PriorityDownloadQueue()
+    dlqueue.put(urldata, priority=dlqueue.INTERACTIVE)
+    ```
+    """
+    URGENT, INTERACTIVE, BACKGROUND = 0, 1, 2
+    PRIORITIES = URGENT, INTERACTIVE, BACKGROUND
+
+    def __init__(self):
+        # priority -> category -> url -> item, categories are taken round-robin
+        self._levels = [OrderedDict() for _ in self.PRIORITIES]
+        self._entries = {}  # url -> (priority, category)
+        self._in_flight = set()  # urls taken but not done yet
+        self._taken = threading.local()
+        self.unfinished_tasks = 0
+
+        self._lock = threading.Lock()
+        self._not_empty = threading.Condition(self._lock)
+        self._all_tasks_done = threading.Condition(self._lock)
+
+    def __contains__(self, url):
+        return url in self._entries
+
+    # =========================================================================
+    # queue.Queue interface
+
+    def put(self, item, block=True, timeout=None, priority=None):
+        """
+        Adds `(url, path, filename)` with a priority, `BACKGROUND` by default.
+        If the url is already queued with a lower priority, it's moved up instead.
+        The queue is never full, `block` and `timeout` are ignored.
+        """
+        if priority is None:
+            priority = self.BACKGROUND
+        url = item[0]
+        with self._lock:
+            if url in self._entries:
+                if priority < self._entries[url][0]:
+                    self._move(url, priority)
+                return
+            if url in self._in_flight:
+                return
+            self._add(item, priority, URLStore.url_category(url))
+            self.unfinished_tasks += 1
+            self._not_empty.notify()
+
+    def put_nowait(self, item, priority=None):
+        return self.put(item, block=False, priority=priority)
+
+    def get(self, block=True, timeout=None):
+        """
+        Takes the next url of the highest priority, raises `queue.Empty` if there's none.
+        Blocks until there is one, or `timeout` seconds pass, when `block` is True.
+        """
+        with self._not_empty:
+            if not block:
+                if not self._entries:
+                    raise Empty
+            elif not self._not_empty.wait_for(lambda: self._entries, timeout):
+                raise Empty
+            item = self._take()
+            self._in_flight.add(item[0])
+        self._get_taken().append(item[0])
+        return item
+
+    def get_nowait(self):
+        return self.get(block=False)
+
+    def task_done(self):
+        """
+        Marks the oldest url taken by this thread as done, so it can be put again.
+        """
+        taken = self._get_taken()
+        with self._all_tasks_done:
+            if self.unfinished_tasks <= 0:
+                raise ValueError('task_done() called too many times')
+            if taken:
+                self._in_flight.discard(taken.pop(0))
+            self._finish(1)
+
+    def join(self):
+        with self._all_tasks_done:
+            self._all_tasks_done.wait_for(lambda: not self.unfinished_tasks)
+
+    def qsize(self):
+        return len(self._entries)
+
+    def empty(self):
+        return not self._entries
+
+    # =========================================================================
+    # priorities
+
+    def get_priority(self, url):
+        """
+        Gets the priority of a queued url, None if it's not queued.
+        """
+        entry = self._entries.get(url)
+        return None if entry is None else entry[0]
+
+    def queued(self, category=None, priority=None):
+        """
+        Lists queued urls in the order they'll be taken in their priority and category.
+        Only urls of a `type/format/category` or a priority if given.
+        """
+        with self._lock:
+            return [url for url in self._select(None, category)
+                    if priority is None or self._entries[url][0] == priority]
+
+    def reprioritize(self, priority, urls=None, category=None):
+        """
+        Moves queued urls to another priority, all of a category if `urls` aren't given.
+        Returns how many urls were moved.
+        """
+        with self._lock:
+            urls = self._select(urls, category)
+            for url in urls:
+                self._move(url, priority)
+            if urls:
+                self._not_empty.notify(len(urls))
+            return len(urls)
+
+    def cancel(self, urls=None, category=None):
+        """
+        Removes queued urls and marks them as done, all of a category \
+        or the whole queue if neither `urls` nor `category` are given.
+        Returns how many urls were removed.
+        """
+        with self._lock:
+            urls = self._select(urls, category)
+            for url in urls:
+                self._remove(url)
+            self._finish(len(urls))
+            return len(urls)
+
+    # =========================================================================
+    # utility, the lock must be held
+
+    def _select(self, urls, category):
+        if urls is not None:
+            return [url for url in dict.fromkeys(urls) if url in self._entries]
+        return [url
+                for level in self._levels
+                for c, items in level.items() if category is None or c == category
+                for url in items]
+
+    def _add(self, item, priority, category):
+        self._entries[item[0]] = priority, category
+        self._levels[priority].setdefault(category, OrderedDict())[item[0]] = item
+
+    def _remove(self, url):
+        priority, category = self._entries.pop(url)
+        level = self._levels[priority]
+        item = level[category].pop(url)
+        if not level[category]:
+            del level[category]
+        return item
+
+    def _move(self, url, priority):
+        category = self._entries[url][1]
+        self._add(self._remove(url), priority, category)
+
+    def _take(self):
+        for level in self._levels:
+            if level:
+                category, items = next(iter(level.items()))
+                url, item = items.popitem(last=False)
+                del self._entries[url]
+                if items:
+                    level.move_to_end(category)
+                else:
+                    del level[category]
+                return item
+
+    def _finish(self, amount):
+        self.unfinished_tasks -= amount
+        if amount and not self.unfinished_tasks:
+            self._all_tasks_done.notify_all()
+
+    def _get_taken(self):
+        """
+        Urls taken by this thread that aren't done yet, doesn't need the lock.
+        """
+        if not hasattr(self._taken, 'urls'):
+            self._taken.urls = []
+        return self._taken.urls
+
+
+class SQLiteQueue:
+    """
+    A download queue in an sqlite database, works like a `queue.Queue` of `(url, path, filename)`.
+    Several processes, or hosts on a shared filesystem, can put urls into and take urls from
+    the same file, so they can download together.
+    ```
+    nekoslife = NekosLife(dlqueue=SQLiteQueue('queue.db'))
+    ```
+    Taken urls are leased for `lease` seconds, the lease is renewed while they're downloading.
+    If they aren't done by then, because the process crashed for example, \
+    another process takes them again.
+    Every url is only queued once, finished urls are kept so they aren't downloaded again.
+    Urls that failed, or whose file is gone, are queued again when they're put again.
+    Delete the file to start over.
+    """
+    LEASE = 5*60
+    POLL_INTERVAL = 0.5  # how often a blocking get checks for new urls
+
+    PENDING, LEASED, DONE, FAILED = 0, 1, 2, 3
+
+    def __init__(self, path, lease=None, worker=None):
+        """
+        `path` is the database file, it's created if it doesn't exist.
+        `lease` is how many seconds a process has to finish a url, `LEASE` by default.
+        `worker` is the name leases are taken under, `host:pid` by default.
+        """
+        self.path = path
+        if lease is not None:
+            self.LEASE = lease
+        self.worker = worker or f'{socket.gethostname()}:{os.getpid()}'
+
+        self._lock = threading.Lock()
+        self._leased = threading.local()
+        self._held = set()  # ids leased by every thread of this process, the lock must be held
+        self._closed = threading.Event()
+        # no WAL, it doesn't work on network filesystems
+        self._connection = sqlite3.connect(path, timeout=60,
+                                           check_same_thread=False, isolation_level=None)
+        with self._transaction() as connection:
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS queue '
+                '(id INTEGER PRIMARY KEY AUTOINCREMENT, url TEXT UNIQUE NOT NULL, '
+                'item TEXT NOT NULL, state INTEGER NOT NULL DEFAULT 0, '
+                'worker TEXT, lease_until REAL)')
+            connection.execute(
+                'CREATE INDEX IF NOT EXISTS queue_state ON queue (state, id)')
+
+        self._renewer = threading.Thread(target=self._renew_leases,
+                                         name='nlqueuelease', daemon=True)
+        self._renewer.start()
+
+    # =========================================================================
+    # queue.Queue interface
+
+    def put(self, item, block=True, timeout=None):
+        """
+        Adds `(url, path, filename)` to the queue, unless the url was already queued.
+        A url that failed, or was done but its file isn't at `path` anymore, is queued again.
+        The queue is never full, `block` and `timeout` are ignored.
+        """
+        url, path = item[0], item[1]
+        with self._transaction() as connection:
+            row = connection.execute('SELECT state FROM queue WHERE url = ?', (url,)).fetchone()
+            if row is None:
+                connection.execute(
+                    'INSERT INTO queue (url, item) VALUES (?, ?)', (url, json.dumps(item)))
+            elif row[0] == self.FAILED or row[0] == self.DONE and not os.path.isfile(path):
+                connection.execute(
+                    'UPDATE queue SET state = ?, item = ?, worker = NULL, lease_until = NULL '
+                    'WHERE url = ?', (self.PENDING, json.dumps(item), url))
+
+    def put_nowait(self, item):
+        return self.put(item, block=False)
+
+    def get(self, block=True, timeout=None):
+        """
+        Takes the oldest url that isn't leased, raises `queue.Empty` if there's none.
+        Blocks until there is one, or `timeout` seconds pass, when `block` is True.
+        """
+        end = None if timeout is None else time.time() + timeout
+        while True:
+            item = self._take()
+            if item is not None:
+                return item
+            if not block:
+                raise Empty
+            wait = self.POLL_INTERVAL
+            if end is not None:
+                wait = min(wait, end - time.time())
+                if wait <= 0:
+                    raise Empty
+            time.sleep(wait)
+
+    def get_nowait(self):
+        return self.get(block=False)
+
+    def task_done(self):
+        """
+        Marks the oldest url taken by this thread as done.
+        """
+        self._finish(self.DONE)
+
+    def task_failed(self):
+        """
+        Same as `task_done`, but the url failed, so putting it again queues it again.
+        """
+        self._finish(self.FAILED)
+
+    def qsize(self):
+        """
+        Amount of urls waiting to be taken, in all processes.
+        """
+        return self._count(
+            'state = ? OR (state = ? AND lease_until < ?)',
+            (self.PENDING, self.LEASED, time.time()))
+
+    def empty(self):
+        return self.qsize() == 0
+
+    @property
+    def unfinished_tasks(self):
+        """
+        Amount of urls that aren't done or failed yet, in all processes.
+        """
+        return self._count('state IN (?, ?)', (self.PENDING, self.LEASED))
+
+    def join(self):
+        """
+        Blocks until every url is done.
+        """
+        while self.unfinished_tasks:
+            time.sleep(self.POLL_INTERVAL)
+
+    def close(self):
+        self._closed.set()
+        self._renewer.join()
+        self._connection.close()
+
+    # =========================================================================
+    # utility
+
+    @contextmanager
+    def _transaction(self):
+        """
+        Runs a write transaction, locking the database right away \
+        so other processes can't take the same url.
+        """
+        with self._lock:
+            self._connection.execute('BEGIN IMMEDIATE')
+            try:
+                yield self._connection
+            except BaseException:
+                self._connection.execute('ROLLBACK')
+                raise
+            self._connection.execute('COMMIT')
+
+    def _take(self):
+        """
+        Leases the oldest url that isn't leased, returns None if there's none.
+        """
+        now = time.time()
+        with self._transaction() as connection:
+            row = connection.execute(
+                'SELECT id, item FROM queue WHERE state = ? OR (state = ? AND lease_until < ?) '
+                'ORDER BY id LIMIT 1',
+                (self.PENDING, self.LEASED, now)).fetchone()
+            if row is None:
+                return None
+            connection.execute(
+                'UPDATE queue SET state = ?, worker = ?, lease_until = ? WHERE id = ?',
+                (self.LEASED, self.worker, now + self.LEASE, row[0]))
+            self._held.add(row[0])
+
+        self._get_leased().append(row[0])
+        return tuple(json.loads(row[1]))
+
+    def _finish(self, state):
+        """
+        Gives the oldest url taken by this thread its final state.
+        """
+        leased = self._get_leased()
+        if not leased:
+            raise ValueError('task_done() called too many times')
+        row = leased.pop(0)
+        with self._transaction() as connection:
+            connection.execute(
+                'UPDATE queue SET state = ?, lease_until = NULL WHERE id = ?', (state, row))
+            self._held.discard(row)
+
+    def _renew_leases(self):
+        """
+        Extends the leases of urls this process is still downloading, every third of `LEASE`, \
+        so a long download isn't taken by another process. Runs until `close`.
+        """
+        while not self._closed.wait(self.LEASE / 3):
+            if not self._held:
+                continue
+            with self._transaction() as connection:
+                connection.executemany(
+                    'UPDATE queue SET lease_until = ? WHERE id = ? AND state = ?',
+                    [(time.time() + self.LEASE, row, self.LEASED) for row in self._held])
+
+    def _get_leased(self):
+        """
+        Ids taken by this thread that aren't done yet.
+        """
+        if not hasattr(self._leased, 'ids'):
+            self._leased.ids = []
+        return self._leased.ids
+
+    def _count(self, where, parameters):
+        with self._lock:
+            return self._connection.execute(
+                f'SELECT COUNT(*) FROM queue WHERE {where}', parameters).fetchone()[0]
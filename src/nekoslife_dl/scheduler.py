@@ -0,0 +1,254 @@
+"""
+The request scheduler file
+Contains RequestScheduler, which rate limits and retries requests for every host
+"""
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlsplit
+import requests
+
+
+class TokenBucket:
+    """
+    Lets through `rate` requests per second, with bursts of up to `burst`.
+    The rate is adaptive, it's halved with `slow_down` and slowly recovers with `speed_up`.
+    A rate of None means no limit.
+    """
+    MIN_RATE = 0.5
+
+    def __init__(self, rate=None, burst=None):
+        self.max_rate = self.rate = rate
+        self.burst = burst or max(rate or 1, 1)
+        self.tokens = self.burst
+        self.last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """
+        Blocks until a request can be sent.
+        """
+        while True:
+            wait = self.reserve()
+            if not wait:
+                return
+            time.sleep(wait)
+
+    def reserve(self):
+        """
+        Takes a token and returns 0 if a request can be sent, \
+        otherwise returns how many seconds until it can. Never blocks.
+        """
+        if self.rate is None:
+            return 0
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.last) * self.rate)
+            self.last = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return 0
+            return (1 - self.tokens) / self.rate
+
+    def slow_down(self):
+        """
+        Halves the rate, used when the host says we're too fast.
+        """
+        if self.rate is not None:
+            with self._lock:
+                self.rate = max(self.rate / 2, self.MIN_RATE)
+
+    def speed_up(self):
+        """
+        Slowly brings the rate back to `max_rate`.
+        """
+        if self.rate is not None and self.rate < self.max_rate:
+            with self._lock:
+                self.rate = min(self.rate + self.max_rate / 20, self.max_rate)
+
+
+class CircuitBreaker:
+    """
+    Stops all requests to a host after `threshold` failures in a row, for `cooldown` seconds.
+    After the cooldown requests are let through again, another failure opens it right away.
+    """
+    def __init__(self, threshold=5, cooldown=30):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.open_until = 0
+        self._lock = threading.Lock()
+
+    @property
+    def is_open(self):
+        return time.monotonic() < self.open_until
+
+    def wait(self):
+        """
+        Blocks while the breaker is open.
+        """
+        while True:
+            wait = self.remaining()
+            if not wait:
+                return
+            time.sleep(wait)
+
+    def remaining(self):
+        """
+        Seconds until the breaker lets requests through again, 0 if it's closed.
+        """
+        return max(self.open_until - time.monotonic(), 0)
+
+    def success(self):
+        with self._lock:
+            self.failures = 0
+
+    def failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.failures >= self.threshold:
+                self.open_for(self.cooldown)
+
+    def open_for(self, seconds):
+        """
+        Stops requests for the next `seconds`.
+        """
+        self.open_until = max(self.open_until, time.monotonic() + seconds)
+
+
+class RequestScheduler:
+    """
+    Sends requests through a session, with a `TokenBucket` and `CircuitBreaker` for every host.
+    Requests that fail with a connection error or a `RETRY_STATUSES` status are retried \
+    up to `retries` times, with exponential backoff and jitter.
+    `Retry-After` is honored and pauses the whole host.
+    ```
+    scheduler = RequestScheduler(requests.Session(), rate=10)
+    r = scheduler.request('GET', url)
+    ```
+    """
+    RETRY_STATUSES = (429, 500, 502, 503, 504)
+    SLOW_DOWN_STATUSES = (429, 503)
+
+    def __init__(self, session, rate=None, burst=None, retries=5,
+                 backoff=0.5, max_backoff=60, breaker_threshold=5, breaker_cooldown=30,
+                 metrics=None):
+        """
+        `rate` is the maximum requests per second for each host, None for no limit.
+        `burst` is how many requests can be sent at once after some time of no requests.
+        `backoff` is the first delay between retries in seconds, it doubles every retry \
+        up to `max_backoff`.
+        `breaker_threshold` failures in a row pause a host for `breaker_cooldown` seconds.
+        `metrics` is a `Metrics` registry retries and paused hosts are counted in.
+        """
+        self.session = session
+        self.rate = rate
+        self.burst = burst
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.breaker_threshold = breaker_threshold
+        self.breaker_cooldown = breaker_cooldown
+        self.metrics = metrics
+
+        self.buckets = {}
+        self.breakers = {}
+        self._lock = threading.Lock()
+
+    def request(self, method, url, **kwargs):
+        """
+        Sends a request, retrying it when it fails.
+        Returns the last response if all retries failed with a bad status,
+        raises the last exception if they failed with a connection error.
+        """
+        bucket, breaker = self.get_host(urlsplit(url).netloc)
+
+        for attempt in range(self.retries + 1):
+            breaker.wait()
+            bucket.acquire()
+            try:
+                r = self.session.request(method, url, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                delay = self.on_error(url, attempt, e)
+                if delay is None:
+                    raise
+            else:
+                delay = self.on_response(url, attempt, r.status_code, r)
+                if delay is None:
+                    return r
+                r.close()
+            time.sleep(delay)
+
+    def on_response(self, url, attempt, status, r):
+        """
+        Updates the host of a response to `attempt`, the first one being 0.
+        Returns how many seconds to wait before retrying, None if it shouldn't be retried.
+        """
+        bucket, breaker = self.get_host(urlsplit(url).netloc)
+        if status not in self.RETRY_STATUSES:
+            breaker.success()
+            bucket.speed_up()
+            return None
+
+        breaker.failure()
+        if status in self.SLOW_DOWN_STATUSES:
+            bucket.slow_down()
+        if attempt == self.retries:
+            return None
+        self._count_retry(url, status)
+
+        delay = self.get_retry_after(r)
+        if delay is None:
+            return self.get_backoff(attempt)
+        breaker.open_for(delay)
+        return delay
+
+    def on_error(self, url, attempt, error):
+        """
+        Same as `on_response`, for a request that failed without a response.
+        """
+        breaker = self.get_host(urlsplit(url).netloc)[1]
+        breaker.failure()
+        if attempt == self.retries:
+            return None
+        self._count_retry(url, type(error).__name__)
+        return self.get_backoff(attempt)
+
+    def _count_retry(self, url, reason):
+        if self.metrics is not None:
+            self.metrics.counter('nekoslife_retries_total',
+                'Requests retried, by host and status or error').inc(
+                host=urlsplit(url).netloc, reason=reason)
+
+    def get_host(self, host):
+        """
+        Returns the `(TokenBucket, CircuitBreaker)` of a host.
+        """
+        with self._lock:
+            if host not in self.buckets:
+                self.buckets[host] = TokenBucket(self.rate, self.burst)
+                self.breakers[host] = CircuitBreaker(self.breaker_threshold, self.breaker_cooldown)
+            return self.buckets[host], self.breakers[host]
+
+    def get_backoff(self, attempt):
+        """
+        Exponential backoff with full jitter.
+        """
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2**attempt))
+
+    def get_retry_after(self, r):
+        """
+        Gets the seconds from a `Retry-After` header, None if there's none.
+        """
+        retry_after = r.headers.get('Retry-After')
+        if retry_after is None:
+            return None
+        try:
+            seconds = float(retry_after)
+        except ValueError:
+            try:
+                seconds = parsedate_to_datetime(retry_after).timestamp() - time.time()
+            except (TypeError, ValueError):
+                return None
+        return min(max(seconds, 0), self.max_backoff)
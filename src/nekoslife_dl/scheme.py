@@ -0,0 +1,157 @@
+"""
+The filename scheme file
+Contains FilenameScheme and SchemeStore, which learn what the urls of a category look like
+"""
+import json
+import os
+import re
+import threading
+from collections import Counter
+try:
+    from urlstore import URLStore
+except ImportError:
+    from .urlstore import URLStore
+
+
+class FilenameScheme:
+    """
+    What the image urls of one category look like: `{base}/{prefix}_{index}.{extension}`.
+    Learned from real urls with `learn`, then used to make the most likely urls for an index.
+    """
+    URL_REGEX = re.compile(r'(.*)/([^/]*)_(\d+)\.(\w+)$')
+    MIN_SAMPLES = 20  # after this many urls, extensions that never showed up are skipped
+
+    def __init__(self, base=None, prefix=None, padding=None, extensions=None, low=None, high=None,
+                 widths=None):
+        """
+        `padding` is the width indexes are padded to with zeros, when a url with a leading zero \
+        confirmed it. None if it's not confirmed, see the `padding` property.
+        `extensions` counts how many urls had each extension.
+        `low` and `high` are the lowest and highest index seen.
+        `widths` counts how many digits the indexes of urls had.
+        """
+        self.base = base
+        self.prefix = prefix
+        self.zero_padding = padding or None # 0 used to be saved when padding wasn't known
+        self.extensions = Counter(extensions or {})
+        self.widths = Counter({int(k): v for k, v in (widths or {}).items()})
+        self.low = low
+        self.high = high
+
+    def learn(self, urls):
+        """
+        Updates the scheme with urls of this category.
+        Returns how many urls matched the scheme.
+        """
+        learned = 0
+        for url in urls:
+            match = self.URL_REGEX.match(url)
+            if match is None:
+                continue
+            self.base, self.prefix, digits, extension = match.groups()
+
+            if len(digits) > 1 and digits.startswith('0'):
+                self.zero_padding = max(self.zero_padding or 0, len(digits))
+            self.widths[len(digits)] += 1
+            self.extensions[extension] += 1
+
+            index = int(digits)
+            self.low = index if self.low is None else min(self.low, index)
+            self.high = index if self.high is None else max(self.high, index)
+            learned += 1
+
+        return learned
+
+    @property
+    def padding(self):
+        """
+        The width indexes are padded to with zeros, 0 if they aren't.
+        Without a url with a leading zero, it's guessed from the shortest index seen, \
+        an index with 3 digits and no leading zero means the padding is at most 3.
+        """
+        if self.zero_padding is not None:
+            return self.zero_padding
+        width = min(self.widths, default=0)
+        return 0 if width <= 1 else width
+
+    @property
+    def samples(self):
+        return sum(self.extensions.values())
+
+    def url(self, index, extension):
+        """
+        Makes the url of an index.
+        """
+        return f'{self.base}/{self.prefix}_{str(index).zfill(self.padding)}.{extension}'
+
+    def candidates(self, index, preferred=(), fallback=()):
+        """
+        Makes the urls an index could have, most likely first.
+        `preferred` extensions go first, for example the ones of neighbouring urls.
+        Then the extensions in order of how common they are.
+        `fallback` extensions are only added while the scheme has less than `MIN_SAMPLES`.
+        """
+        extensions = [*preferred, *(e for e, _ in self.extensions.most_common())]
+        if self.samples < self.MIN_SAMPLES:
+            extensions.extend(fallback)
+        return [self.url(index, e) for e in dict.fromkeys(extensions)]
+
+    def to_dict(self):
+        return {
+            'base': self.base, 'prefix': self.prefix, 'padding': self.zero_padding,
+            'extensions': dict(self.extensions), 'low': self.low, 'high': self.high,
+            'widths': dict(self.widths),
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(**data)
+
+
+class SchemeStore:
+    """
+    Keeps a `FilenameScheme` for every `type/format/category`.
+    When a `path` is given, the schemes are saved there between runs.
+    """
+    def __init__(self, path=None):
+        self.path = path
+        self.schemes = {}
+        self._lock = threading.Lock()
+
+        if path is not None and os.path.isfile(path):
+            with open(path, 'r') as file:
+                self.schemes = {category: FilenameScheme.from_dict(data)
+                                for category, data in json.load(file).items()}
+
+    def get(self, category) -> FilenameScheme:
+        """
+        Gets the scheme of a category, an empty one if nothing was learned yet.
+        """
+        with self._lock:
+            if category not in self.schemes:
+                self.schemes[category] = FilenameScheme()
+            return self.schemes[category]
+
+    def learn(self, urls):
+        """
+        Learns urls of any category.
+        """
+        categories = {}
+        for url in urls:
+            categories.setdefault(URLStore.url_category(url), []).append(url)
+
+        for category, urls in categories.items():
+            scheme = self.get(category)
+            with self._lock:
+                scheme.learn(urls)
+
+    def save(self):
+        """
+        Saves all schemes into `path`, does nothing without one.
+        """
+        if self.path is None:
+            return
+        with self._lock:
+            data = {category: scheme.to_dict() for category, scheme in self.schemes.items()}
+        with open(self.path, 'w') as file:
+            json.dump(data, file, indent=4)
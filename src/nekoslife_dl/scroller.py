@@ -1,9 +1,82 @@
 import os,time,random,threading
+from collections import OrderedDict
+from io import BytesIO
 try:
     from nekoslife import NekosLife
+    from queues import PriorityDownloadQueue
 except ImportError:
     # I'm not dealing with this shit, god fucking damnit
     from .nekoslife import NekosLife
+    from .queues import PriorityDownloadQueue
+
+class ImageBuffer:
+    """
+    Keeps downloaded images in memory, at most `max_images` of them and `max_bytes` in total.
+    When it's full, the oldest images are thrown away and `on_evict(filename)` is called.
+    """
+    def __init__(self, max_images, max_bytes=None, on_evict=None):
+        self.max_images = max_images
+        self.max_bytes = max_bytes
+        self.on_evict = on_evict
+        self.images = OrderedDict()  # filename -> bytes, oldest first
+        self.size = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.images)
+
+    def __contains__(self, filename):
+        return filename in self.images
+
+    def add(self, filename, data):
+        """
+        Adds an image, returns the filenames that were thrown away to make room.
+        """
+        evicted = []
+        with self._lock:
+            if filename in self.images:
+                self.size -= len(self.images.pop(filename))
+            self.images[filename] = data
+            self.size += len(data)
+            while len(self.images) > 1 and (len(self.images) > self.max_images or
+                    self.max_bytes is not None and self.size > self.max_bytes):
+                old, old_data = self.images.popitem(last=False)
+                self.size -= len(old_data)
+                evicted.append(old)
+
+        if self.on_evict is not None:
+            for old in evicted:
+                self.on_evict(old)
+        return evicted
+
+    def pop(self, filename=None):
+        """
+        Takes out an image, the oldest one by default. Returns `(filename, bytes)`.
+        """
+        with self._lock:
+            if filename is None:
+                filename, data = self.images.popitem(last=False)
+            else:
+                data = self.images.pop(filename)
+            self.size -= len(data)
+        return filename, data
+
+    def peek(self, amount):
+        """
+        Returns the `amount` oldest images as `(filename, bytes)`, without taking them out.
+        """
+        with self._lock:
+            return [item for item, _ in zip(self.images.items(), range(amount))]
+
+    def filenames(self):
+        with self._lock:
+            return list(self.images)
+
+    def clear(self):
+        with self._lock:
+            self.images.clear()
+            self.size = 0
+
 
 class NekosLifeScroller(NekosLife):
     """
@@ -14,35 +87,63 @@ class NekosLifeScroller(NekosLife):
     Needs a periodical download with `get_images_ready`
     
     Instead of using function returns, use `current_image`.
+    Images are downloaded with `INTERACTIVE` priority, so they go before background downloads.
+
+    With `in_memory`, images are never written to disk. They're kept in an `ImageBuffer`,
+    shown oldest first and `current_image` is a `BytesIO`.
     """
     MAX_IMAGES = 60
+    MAX_BYTES = 0x10000000  # 256MiB, only used in memory
+    DOWNLOAD_PRIORITY = PriorityDownloadQueue.INTERACTIVE
     current_image = None
+    current_filename = None
     get_thread = None
+    buffer = None
+    upcoming = ()
     
-    def __init__(self,save_folder='.temp',*args,**kwargs):
+    def __init__(self,save_folder='.temp',*args,in_memory=False,max_bytes=None,**kwargs):
         """
         Initializes the NekosLife class.
         Save folder is for the images, they will be deleted afterwards.
+        `in_memory` keeps images in memory instead, at most `MAX_IMAGES` \
+        and `max_bytes` (`MAX_BYTES` by default) of them.
         """
+        if in_memory:
+            if kwargs.get('hash_index') is not None or kwargs.get('thumbnail_sizes'):
+                raise ValueError('hash_index and thumbnails need images on disk, '
+                                 'they can\'t be used in memory')
+            self.buffer = ImageBuffer(self.MAX_IMAGES, max_bytes or self.MAX_BYTES,
+                                      on_evict=self.remove_downloaded)
         super().__init__(save_folder,*args,**kwargs)
+        self.upcoming = [] # paths get_next_image will pick next, see peek_next_images
+        if in_memory:
+            self.downloaded = set()
+            return
 
         files = self.listdir()
         if len(files) > 0:
             self.current_image = files[0]
+            self.current_filename = os.path.split(files[0])[1]
     
     def listdir(self):
         """
-        Lists all files in savefolder.
+        Lists all downloaded files in savefolder.
+        In memory, lists the filenames of buffered images.
         """
-        files = []
-        for i in os.listdir(self.save_folder):
-            if os.path.splitext(i)[-1].endswith('.000'):
-                continue
-            path = os.path.join(self.save_folder,i)
-            if os.path.isfile(path):
-                files.append(path)
-        
-        return files
+        if self.buffer is not None:
+            return self.buffer.filenames()
+        return [os.path.join(self.save_folder,i) for i in self.get_downloaded()]
+
+    def download_url(self, url, path, dlpath=None, special_filename=None, digest=None):
+        """
+        Same as `NekosLife.download_url`, but in memory the image goes into `buffer`.
+        """
+        if self.buffer is None:
+            return super().download_url(url, path, dlpath, special_filename, digest)
+
+        start = time.time()
+        self.buffer.add(os.path.split(path)[1], self.download_bytes(url, digest))
+        return time.time() - start
 
     def get_images_ready(self,imgtype: str, imgformat: str, imgcategory: str):
         """
@@ -64,43 +165,92 @@ class NekosLifeScroller(NekosLife):
         
         return True
 
-    def wait_until_image_avalible(self,amount=1):
+    def wait_until_image_avalible(self,amount=1,timeout=None):
         """
         Wait until there's an image in the save folder.
+        Wakes up whenever a download finishes, returns False if `timeout` passed.
         Remember to run `get_images_ready`, otherwise it will stall forever
         """
-        while len(self.listdir()) < amount:
-            pass # you could raise here
+        images = self.downloaded if self.buffer is None else self.buffer
+        return self.wait_for_download(lambda: len(images) >= amount, timeout)
     
     def get_current_image(self):
-        return self.current_image,os.path.split(self.current_image)[1]
+        if self.buffer is not None:
+            self.current_image.seek(0)
+        return self.current_image,self.current_filename
     
     def get_next_image(self,remove=True):
         """
         Returns path and filename of next image.
         Automatically sets path as `current_image`.
         If there is no file, waits for download workers to download new ones.
+        In memory, returns a `BytesIO` instead of a path, the old image is always dropped.
         """
+        if self.buffer is not None:
+            self.wait_until_image_avalible(1)
+            filename, data = self.buffer.pop()
+            self.remove_downloaded(filename)
+            self.current_image,self.current_filename = BytesIO(data),filename
+            return self.current_image,filename
+
         self.wait_until_image_avalible(2)
         
         if remove and self.current_image is not None:
             os.remove(self.current_image)
-        self.current_image = random.choice(self.listdir())
+            self.remove_downloaded(os.path.split(self.current_image)[1])
+            if self.thumbnails is not None:
+                self.thumbnails.remove(os.path.split(self.current_image)[1])
+        upcoming = self._get_upcoming()
+        self.current_image = upcoming.pop(0) if upcoming else random.choice(self.listdir())
 
         filename = os.path.split(self.current_image)[1]
+        self.current_filename = filename
         
         return self.current_image,filename
 
+    def peek_next_images(self,amount):
+        """
+        Returns up to `amount` `(path,filename)` that `get_next_image` will return next, in order.
+        Nothing is taken, in memory paths are new `BytesIO`s.
+        Lets a viewer prepare images before they're shown.
+        """
+        if self.buffer is not None:
+            return [(BytesIO(data),filename) for filename,data in self.buffer.peek(amount)]
+
+        upcoming = self._get_upcoming()
+        files = [i for i in self.listdir() if i != self.current_image and i not in upcoming]
+        random.shuffle(files)
+        upcoming += files[:amount-len(upcoming)]
+        return [(path,os.path.split(path)[1]) for path in upcoming[:amount]]
+
+    def _get_upcoming(self):
+        """
+        Drops upcoming paths that were removed in the meantime.
+        """
+        downloaded = set(self.get_downloaded())
+        self.upcoming[:] = [i for i in self.upcoming
+                            if i != self.current_image and os.path.split(i)[1] in downloaded]
+        return self.upcoming
+
     def reset_session(self,new_session):
         """
         Removes all files in temp and downloads new ones.
         Also deletes unexpected images.
         """
-        self.empty_dlqueue()
+        self.cancel_downloads()
         self.wait_until_finished()
         
+        if self.buffer is not None:
+            self.buffer.clear()
+            with self._downloaded_lock:
+                self.downloaded = set()
+            return self.new_session(new_session)
+
         for path in os.listdir(self.save_folder):
             os.remove(os.path.join(self.save_folder,path))
+            if self.thumbnails is not None:
+                self.thumbnails.remove(path)
+        self.rescan_save_folder()
 
         return self.new_session(new_session)
 
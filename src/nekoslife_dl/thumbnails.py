@@ -0,0 +1,97 @@
+"""
+The thumbnails file
+Contains ThumbnailCache, small copies of downloaded images kept next to the save folder
+"""
+import os
+try:
+    from PIL import Image
+except ImportError:
+    Image = None # pillow is only needed for thumbnails
+
+
+class ThumbnailCache:
+    """
+    Keeps thumbnails of the images in `source_folder` in `folder`, as `{size}/{filename}.jpg`.
+    A thumbnail fits into `size`x`size`, animated images only get their first frame.
+    Thumbnails older than their image are stale and made again when they're asked for.
+    ```
+    thumbnails = ThumbnailCache('images.thumbnails', 'images', sizes=(256, 1024))
+    thumbnails.add('neko_001.jpg')
+    path = thumbnails.get('neko_001.jpg', 400, 300)
+    ```
+    """
+    SIZES = (256,)
+    EXTENSION = '.jpg'
+    QUALITY = 85
+    REDUCING_GAP = 2.0
+
+    def __init__(self, folder, source_folder, sizes=None):
+        """
+        `folder` is where thumbnails are saved, it's created if it doesn't exist.
+        `sizes` are the sizes every image gets a thumbnail in, `SIZES` by default.
+        """
+        if Image is None:
+            raise ImportError('pillow is needed for thumbnails, install it with `pip install pillow`')
+        self.folder = folder
+        self.source_folder = source_folder
+        self.sizes = tuple(sorted(set(sizes or self.SIZES)))
+        for size in self.sizes:
+            os.makedirs(os.path.join(folder, str(size)), exist_ok=True)
+
+    def path(self, filename, size):
+        return os.path.join(self.folder, str(size), filename+self.EXTENSION)
+
+    def is_fresh(self, filename, size) -> bool:
+        """
+        Whether the thumbnail exists and its image wasn't changed after it was made.
+        """
+        try:
+            return (os.stat(self.path(filename, size)).st_mtime
+                    >= os.stat(os.path.join(self.source_folder, filename)).st_mtime)
+        except FileNotFoundError:
+            return False
+
+    def add(self, filename, sizes=None):
+        """
+        Makes thumbnails of an image in `source_folder`, in all `sizes` by default.
+        The image is decoded once, then shrunk from the biggest size to the smallest.
+        Raises an `OSError` if the image can't be read.
+        """
+        sizes = sorted(sizes or self.sizes, reverse=True)
+        with Image.open(os.path.join(self.source_folder, filename)) as img:
+            img.draft('RGB', (sizes[0], sizes[0]))
+            img = img.convert('RGB')
+        for size in sizes:
+            img.thumbnail((size, size), reducing_gap=self.REDUCING_GAP)
+            path = self.path(filename, size)
+            img.save(path+'.000', 'JPEG', quality=self.QUALITY)
+            os.replace(path+'.000', path)
+
+    def get(self, filename, width, height=None, make=True):
+        """
+        Returns the path of the smallest thumbnail that's at least `width`x`height`, \
+        None if every size is smaller or the image doesn't exist.
+        With `make`, a missing or stale thumbnail is made first.
+        """
+        wanted = max(width, height or 0)
+        size = next((size for size in self.sizes if size >= wanted), None)
+        if size is None:
+            return None
+        if not self.is_fresh(filename, size):
+            if not make or not os.path.isfile(os.path.join(self.source_folder, filename)):
+                return None
+            try:
+                self.add(filename, [size])
+            except OSError:
+                return None
+        return self.path(filename, size)
+
+    def remove(self, filename):
+        """
+        Deletes all thumbnails of an image, use after deleting it.
+        """
+        for size in self.sizes:
+            try:
+                os.remove(self.path(filename, size))
+            except FileNotFoundError:
+                pass
@@ -0,0 +1,182 @@
+"""
+The url store file
+Contains URLStore, an indexed replacement for plain text url files
+"""
+import sqlite3
+import threading
+
+
+class URLStore:
+    """
+    Stores urls in an sqlite database, with a table for every category.
+    The category is taken from the url itself (`type/format/category`),
+    so urls of different categories can be mixed freely.
+
+    Adding urls and checking if one is known never reads the whole store.
+    ```
+    store = URLStore('urls.db')
+    store.add_urls(urls)
+    url in store
+    ```
+    Plain text url files can be moved over with `import_file` and back with `export_file`.
+    """
+    EXTENSIONS = ('.db', '.sqlite', '.sqlite3')
+
+    def __init__(self, path):
+        """
+        `path` is the database file, it's created if it doesn't exist.
+        """
+        self.path = path
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._tables = set(self._query(
+            "SELECT name FROM sqlite_master WHERE type='table'"))
+
+    def __contains__(self, url):
+        return self.has_url(url)
+
+    def __len__(self):
+        return sum(self._query(f'SELECT COUNT(*) FROM {self._quote(c)}')[0]
+                   for c in self.categories())
+
+    # =========================================================================
+    # urls
+
+    def has_url(self, url) -> bool:
+        """
+        Checks if the url is in the store.
+        """
+        category = self.url_category(url)
+        if category not in self._tables:
+            return False
+        return bool(self._query(
+            f'SELECT 1 FROM {self._quote(category)} WHERE url = ?', (url,)))
+
+    def add_urls(self, urls):
+        """
+        Adds urls into the store, returns the ones that weren't there yet.
+        """
+        added = []
+        with self._lock, self._connection:
+            for url in urls:
+                category = self._create_table(self.url_category(url))
+                cursor = self._connection.execute(
+                    f'INSERT OR IGNORE INTO {self._quote(category)} VALUES (?)', (url,))
+                if cursor.rowcount:
+                    added.append(url)
+        return added
+
+    def get_urls(self, category=None):
+        """
+        Gets all urls of a `type/format/category`, all urls in the store by default.
+        """
+        categories = self.categories() if category is None else [category]
+        urls = []
+        for category in categories:
+            if category in self._tables:
+                urls.extend(self._query(f'SELECT url FROM {self._quote(category)}'))
+        return urls
+
+    def set_urls(self, urls, category=None):
+        """
+        Replaces the urls of a category, or the whole store, with urls.
+        """
+        categories = self.categories() if category is None else [category]
+        with self._lock, self._connection:
+            for category in categories:
+                if category in self._tables:
+                    self._connection.execute(f'DELETE FROM {self._quote(category)}')
+        return self.add_urls(urls)
+
+    def categories(self):
+        """
+        Lists all categories in the store.
+        """
+        return sorted(self._tables)
+
+    # =========================================================================
+    # plain text files
+
+    def import_file(self, path):
+        """
+        Adds all urls from a plain text file. Urls must be seperated by `\\n`.
+        Returns the amount of new urls.
+        """
+        with open(path, 'r') as file:
+            urls = [url.strip('\n') for url in file if len(url) > 1]
+        return len(self.add_urls(urls))
+
+    def export_file(self, path, category=None, key=None):
+        """
+        Writes urls into a plain text file, seperated by `\\n`.
+        `key` sorts the urls, for example `NekosLife.url_index`.
+        """
+        urls = self.get_urls(category)
+        if key is not None:
+            urls.sort(key=key)
+        with open(path, 'w') as file:
+            file.write('\n'.join(urls))
+        return urls
+
+    def close(self):
+        self._connection.close()
+
+    # =========================================================================
+    # utility
+
+    @staticmethod
+    def url_category(url) -> str:
+        """
+        Gets the `type/format/category` out of an image url.
+        """
+        return '/'.join(url.split('/')[-4:-1])
+
+    @staticmethod
+    def _quote(category):
+        """
+        Quotes a category so it can be used as a table name.
+        """
+        return '"' + category.replace('"', '""') + '"'
+
+    def _create_table(self, category):
+        """
+        Makes sure the table for a category exists.
+        Must be called with the lock held.
+        """
+        if category not in self._tables:
+            self._connection.execute(
+                f'CREATE TABLE IF NOT EXISTS {self._quote(category)} '
+                '(url TEXT PRIMARY KEY) WITHOUT ROWID')
+            self._tables.add(category)
+        return category
+
+    def _query(self, sql, parameters=()):
+        """
+        Runs a query, returns the first column of every row.
+        """
+        with self._lock:
+            return [row[0] for row in self._connection.execute(sql, parameters)]
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser('urlstore',
+        description="Moves urls between plain text url files and a url store.")
+    parser.add_argument('store')
+    parser.add_argument('action', choices=('import', 'export'))
+    parser.add_argument('file')
+    parser.add_argument('-c', '--category',
+        help="Only export this `type/format/category`.")
+    args = parser.parse_args()
+
+    store = URLStore(args.store)
+    if args.action == 'import':
+        print(f'[*] imported {store.import_file(args.file)} new urls')
+    else:
+        try:
+            from nekoslife import NekosLife
+        except ImportError:
+            from .nekoslife import NekosLife
+        urls = store.export_file(args.file, args.category, key=NekosLife.url_index)
+        print(f'[*] exported {len(urls)} urls')
+    store.close()
@@ -0,0 +1,161 @@
+"""
+The workers file
+Contains DownloadWorkerPool, a pool of download threads that can be resized while running
+"""
+import threading
+import time
+
+
+class DownloadWorkerPool:
+    """
+    Runs `work(stopped)` on `size` daemon threads, `work` should return soon after \
+    `stopped()` becomes True. Used by `NekosLife` to run `download_worker`.
+    ```
+    pool = DownloadWorkerPool(nekoslife.download_worker, 4)
+    pool.resize(8)
+    pool.shutdown()
+    ```
+    With `autoscale`, a controller thread changes the size every `INTERVAL` seconds:
+    - more than `ERROR_RATE` of downloads failed: halves the size, the CDN is struggling
+    - nothing is queued: removes a worker, it would only be idle
+    - more is queued than there are workers: adds workers as long as that raises \
+      the bytes per second by `IMPROVEMENT`, otherwise goes back and waits `HOLD` intervals
+    """
+    INTERVAL = 5
+    ERROR_RATE = 0.2
+    IMPROVEMENT = 0.05  # 5% more throughput is needed to keep an added worker
+    HOLD = 3
+
+    def __init__(self, work, size=1, min_size=1, max_size=None, autoscale=False,
+                 stats=None, backlog=None, name='nldlworker', on_resize=None):
+        """
+        `min_size` and `max_size` bound both autoscaling and `resize`.
+        `stats()` returns the total `(downloaded, failed, bytes)` so far, needed for `autoscale`.
+        `backlog()` returns how many urls are waiting, needed for `autoscale`.
+        `on_resize(size)` is called every time the size changes.
+        """
+        self.work = work
+        self.min_size = min_size
+        self.max_size = max_size
+        self.stats = stats
+        self.backlog = backlog
+        self.name = name
+        self.on_resize = on_resize
+
+        self.workers = []  # (thread, stop event)
+        self._stopping = []  # stopped threads that may still be downloading
+        self._counter = 0
+        self._lock = threading.Lock()
+        self._shutdown = threading.Event()
+
+        self._last_stats = None
+        self._last_throughput = None
+        self._last_step = 0
+        self._hold = 0
+
+        self.resize(size)
+        self._controller = None
+        if autoscale:
+            self._controller = threading.Thread(target=self._autoscale,
+                                                name=f'{name}_autoscaler', daemon=True)
+            self._controller.start()
+
+    @property
+    def size(self):
+        """
+        How many workers are running, not counting ones that are finishing their last download.
+        """
+        with self._lock:
+            return len(self.workers)
+
+    def resize(self, size):
+        """
+        Starts or stops workers until there are `size`, within `min_size` and `max_size`.
+        Stopped workers finish their current download first.
+        Returns the new size.
+        """
+        size = max(size, self.min_size)
+        if self.max_size is not None:
+            size = min(size, self.max_size)
+
+        with self._lock:
+            if self._shutdown.is_set():
+                return len(self.workers)
+            while len(self.workers) < size:
+                stop = threading.Event()
+                thread = threading.Thread(target=self.work, args=(stop.is_set,),
+                                          name=f'{self.name}_{self._counter}', daemon=True)
+                self._counter += 1
+                thread.start()
+                self.workers.append((thread, stop))
+            while len(self.workers) > size:
+                thread, stop = self.workers.pop()
+                stop.set()
+                self._stopping.append(thread)
+            self._stopping = [thread for thread in self._stopping if thread.is_alive()]
+
+        if self.on_resize is not None:
+            self.on_resize(size)
+        return size
+
+    def shutdown(self, wait=True, timeout=None):
+        """
+        Stops all workers and autoscaling. With `wait`, blocks until current downloads finish, \
+        at most `timeout` seconds. Returns True if all workers stopped.
+        """
+        self._shutdown.set()
+        with self._lock:
+            workers, self.workers = self.workers, []
+            threads = self._stopping + [thread for thread, stop in workers]
+        for thread, stop in workers:
+            stop.set()
+        if not wait:
+            return False
+
+        end = None if timeout is None else time.time() + timeout
+        for thread in threads:
+            thread.join(None if end is None else max(end - time.time(), 0))
+        return not any(thread.is_alive() for thread in threads)
+
+    # =========================================================================
+    # autoscaling
+
+    def _autoscale(self):
+        while not self._shutdown.wait(self.INTERVAL):
+            self.autoscale_step()
+
+    def autoscale_step(self):
+        """
+        Looks at what happened since the last step and changes the size.
+        Returns the new size.
+        """
+        stats = self.stats()
+        last, self._last_stats = self._last_stats, stats
+        if last is None:
+            return self.size
+
+        downloaded, failed, size = (now - before for now, before in zip(stats, last))
+        throughput = size / self.INTERVAL
+        workers = self.size
+
+        if failed and failed / (downloaded + failed) > self.ERROR_RATE:
+            step = workers//2 - workers
+        elif not self.backlog():
+            step = -1
+        elif self._hold:
+            self._hold -= 1
+            step = 0
+        elif (self._last_step > 0 and self._last_throughput is not None
+              and throughput < self._last_throughput * (1 + self.IMPROVEMENT)):
+            # the last added workers didn't help
+            step = -self._last_step
+            self._hold = self.HOLD
+        elif self.backlog() > workers:
+            step = max(1, workers//4)
+        else:
+            step = 0
+
+        self._last_throughput = throughput
+        new_size = self.resize(workers + step) if step else workers
+        self._last_step = new_size - workers
+        return new_size
@@ -1,30 +1,185 @@
 import math
+import sys
+import threading
 import time
 import tkinter as tk
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
 from pprint import pprint
 from tkinter import ttk
 from PIL import Image, ImageTk
 from nekoslife_dl import NekosLifeScroller
 
+THUMBNAIL_SIZES = 512, 1024, 2048
+
+class Animation:
+    """
+    A gif or other multi-frame image, frames are decoded and resized lazily on `executor`.
+    Resized frames are cached until they take up `MEMORY` bytes, \
+    the ones that don't fit are decoded again every loop.
+    """
+    MEMORY = 0x4000000 # 64MiB
+    DEFAULT_DURATION = 100 # ms, for frames without one
+    MIN_DURATION = 20
+
+    def __init__(self, data, resize, maxwidth, maxheight, executor):
+        self.data = data
+        self.resize = resize
+        self.maxwidth, self.maxheight = maxwidth, maxheight
+        self.executor = executor
+        self.image = None
+        self.frames = {} # index -> (frame, duration)
+        self.size = 0 # bytes taken by frames
+        self.pending = {} # index -> future, only used from the Tk thread
+        self._lock = threading.Lock()
+
+        self.n_frames = self._open().n_frames
+        self._decode(0)
+
+    def _open(self):
+        if self.image is None:
+            self.image = Image.open(BytesIO(self.data))
+        return self.image
+
+    def _decode(self, index):
+        with self._lock:
+            image = self._open()
+            image.seek(index)
+            duration = image.info.get('duration') or self.DEFAULT_DURATION
+            frame = self.resize(image.convert('RGBA'), self.maxwidth, self.maxheight)
+            frame = frame, max(duration, self.MIN_DURATION)
+
+            size = frame[0].width * frame[0].height * 4
+            if index not in self.frames and self.size+size <= self.MEMORY:
+                self.frames[index] = frame
+                self.size += size
+        return frame
+
+    def get_frame(self, index):
+        """
+        Returns `(frame, duration in ms)` if it's ready, otherwise starts decoding it and returns None.
+        """
+        frame = self.frames.get(index)
+        if frame is not None:
+            return frame
+
+        future = self.pending.get(index)
+        if future is None:
+            self.pending[index] = self.executor.submit(self._decode, index)
+            return None
+        if not future.done():
+            return None
+        del self.pending[index]
+        return future.result()
+
+    def release(self):
+        """
+        Frees all frames except the first one, they're decoded again if it's shown again.
+        """
+        for future in self.pending.values():
+            future.cancel()
+        self.pending = {}
+        with self._lock:
+            first = self.frames.get(0)
+            self.frames = {} if first is None else {0: first}
+            self.size = 0 if first is None else first[0].width * first[0].height * 4
+            if self.image is not None:
+                self.image.close()
+                self.image = None
+
+class ImagePipeline:
+    """
+    Opens, decodes and resizes images on background threads, so Tk only has to show them.
+    Results are futures kept in an LRU cache of `CACHE_SIZE`, keyed by filename and size.
+    Animated images give an `Animation` instead of an image.
+    Still images on disk are swapped for the thumbnail `get_thumbnail(filename, width, height)` gives, \
+    it's called on the background threads since it may have to make the thumbnail first.
+    Only used from the Tk thread.
+    """
+    THREADS = 2
+    CACHE_SIZE = 16
+
+    def __init__(self, resize, get_thumbnail=None):
+        self.resize = resize # (img, maxwidth, maxheight) -> img
+        self.get_thumbnail = get_thumbnail # (filename, width, height) -> path or None
+        self.cache = OrderedDict() # (filename, maxwidth, maxheight) -> future
+        self.executor = ThreadPoolExecutor(self.THREADS, thread_name_prefix='nldecoder')
+
+    def thumbnail(self, imgpath, filename, maxwidth, maxheight):
+        """
+        Swaps a still image on disk for its thumbnail, if there's one big enough.
+        """
+        if self.get_thumbnail is None or not isinstance(imgpath, str) or filename.endswith('.gif'):
+            return imgpath
+        return self.get_thumbnail(filename, maxwidth, maxheight) or imgpath
+
+    def decode(self, imgpath, filename, maxwidth, maxheight):
+        imgpath = self.thumbnail(imgpath, filename, maxwidth, maxheight)
+        with Image.open(imgpath) as img:
+            if not getattr(img, 'is_animated', False):
+                return self.resize(img, maxwidth, maxheight)
+
+        # animations are read into memory, so the file isn't kept open while it plays
+        if isinstance(imgpath, str):
+            with open(imgpath, 'rb') as file:
+                data = file.read()
+        else:
+            imgpath.seek(0)
+            data = imgpath.read()
+        return Animation(data, self.resize, maxwidth, maxheight, self.executor)
+
+    def submit(self, imgpath, filename, maxwidth, maxheight):
+        """
+        Returns a future of the resized image, starts decoding it if it isn't cached.
+        """
+        key = filename, maxwidth, maxheight
+        if key in self.cache:
+            self.cache.move_to_end(key)
+            return self.cache[key]
+
+        future = self.cache[key] = self.executor.submit(
+            self.decode, imgpath, filename, maxwidth, maxheight)
+        while len(self.cache) > self.CACHE_SIZE:
+            self.cache.popitem(last=False)[1].cancel()
+        return future
 
 class ImageDisplay(tk.Frame):
     MAXWIDTH, MAXHEIGHT = 1000, 600
     IMGNORMALIZE = False
+    PREVIEW = True # decode at about the display size, False decodes the whole image
+    REDUCING_GAP = 2.0
+    PRELOAD = 4 # images decoded ahead, less than ImagePipeline.CACHE_SIZE
+    POLL_INTERVAL = 10 # ms between checks whether an image is decoded
     fontsize = 12
 
-    def __init__(self, master):
+    def __init__(self, master, get_thumbnail=None):
+        """
+        `get_thumbnail(filename, width, height)` returns the path of a thumbnail \
+        to show instead of a still image, or None, see `NekosLife.get_thumbnail`.
+        """
         super().__init__(master)
 
         self.label = tk.Label(self, font=("Arial", self.fontsize), compound='top')
         self.label.pack()
+        self.pipeline = ImagePipeline(self.resize_img, get_thumbnail)
+        self.shown = None
+        self.animation = None
 
-    def resize_img(self, img):
-        if self.MAXWIDTH > 0 and self.MAXHEIGHT > 0:
-            ratio = min(self.MAXWIDTH/img.width, self.MAXHEIGHT/img.height)
-        elif self.MAXWIDTH > 0:
-            ratio = self.MAXWIDTH/img.width
-        elif self.MAXHEIGHT > 0:
-            ratio = self.MAXHEIGHT/img.height
+    def resize_img(self, img, maxwidth=None, maxheight=None):
+        """
+        Fits an image into `maxwidth`x`maxheight`, `MAXWIDTH`x`MAXHEIGHT` by default.
+        With `PREVIEW`, jpegs are decoded at a reduced scale and other images \
+        are shrunk in steps first, so big images take about as long as small ones.
+        """
+        maxwidth = self.MAXWIDTH if maxwidth is None else maxwidth
+        maxheight = self.MAXHEIGHT if maxheight is None else maxheight
+        if maxwidth > 0 and maxheight > 0:
+            ratio = min(maxwidth/img.width, maxheight/img.height)
+        elif maxwidth > 0:
+            ratio = maxwidth/img.width
+        elif maxheight > 0:
+            ratio = maxheight/img.height
         else:
             ratio = 1
 
@@ -40,16 +195,77 @@ class ImageDisplay(tk.Frame):
         if width == 0 or height == 0:
             width = height = 1
 
-        return img.resize((width, height))
+        if not self.PREVIEW:
+            return img.resize((width, height))
+        img.draft(img.mode, (width, height)) # only does something for jpegs that aren't loaded yet
+        return img.resize((width, height), reducing_gap=self.REDUCING_GAP)
 
     def update_display(self, imgpath, filename):
-        img = Image.open(imgpath)
-        img = self.resize_img(img)
-        img = ImageTk.PhotoImage(img)
+        future = self.pipeline.submit(imgpath, filename, self.MAXWIDTH, self.MAXHEIGHT)
+        self.shown = future
+        if self.animation is not None:
+            self.animation.release()
+            self.animation = None
+        if not future.done():
+            self.label.configure(text=filename+' (loading)')
+        self.show_decoded(future, filename)
+
+    def show_decoded(self, future, filename):
+        """
+        Shows an image once it's decoded, without blocking Tk.
+        """
+        if future is not self.shown:
+            return # scrolled past it already
+        if not future.done():
+            self.after(self.POLL_INTERVAL, self.show_decoded, future, filename)
+            return
+
+        try:
+            img = future.result()
+        except Exception as e:
+            return self.show_error(filename, e)
 
+        if isinstance(img, Animation):
+            self.animation = img
+            return self.play(img, filename, 0)
+        self.show_image(ImageTk.PhotoImage(img), filename)
+
+    def play(self, animation, filename, index):
+        """
+        Shows frame `index` for its duration, then the next one.
+        The next frame is decoded while this one is shown.
+        """
+        if animation is not self.animation:
+            return # scrolled past it already
+        try:
+            frame = animation.get_frame(index)
+        except Exception as e:
+            return self.show_error(filename, e)
+        if frame is None:
+            self.after(self.POLL_INTERVAL, self.play, animation, filename, index)
+            return
+
+        img, duration = frame
+        self.show_image(ImageTk.PhotoImage(img), filename)
+        index = (index+1) % animation.n_frames
+        animation.get_frame(index)
+        self.after(duration, self.play, animation, filename, index)
+
+    def show_image(self, img, filename):
         self.label.configure(text=filename, image=img)
         self.label.image = img
 
+    def show_error(self, filename, error):
+        self.label.configure(text=f'{filename} ({error})', image='')
+        self.label.image = None
+
+    def preload(self, images):
+        """
+        Starts decoding `(imgpath, filename)` that will be shown next.
+        """
+        for imgpath, filename in images[:self.PRELOAD]:
+            self.pipeline.submit(imgpath, filename, self.MAXWIDTH, self.MAXHEIGHT)
+
     def update_resolution(self, maxwidth, maxheight):
         self.MAXWIDTH = maxwidth
         self.MAXHEIGHT = maxheight-60 # other widgets take up some space
@@ -103,6 +319,7 @@ class CategoryChooser(tk.Frame):
 def update_display(imagedata):
     image_display.update_resolution(root.winfo_width(),root.winfo_height())
     image_display.update_display(*imagedata)
+    image_display.preload(nekoslife.peek_next_images(image_display.PRELOAD))
     
 def new_session():
     nekoslife.new_session(category_chooser.get_category())
@@ -123,7 +340,9 @@ def update_loaded():
 
 if __name__ == '__main__':
     print('INITIALIZING')
-    nekoslife = NekosLifeScroller(download_threads=3)
+    nekoslife = NekosLifeScroller(download_threads=3, in_memory='--in-memory' in sys.argv,
+        thumbnail_sizes=THUMBNAIL_SIZES if '--thumbnails' in sys.argv else None)
+    ImageDisplay.PREVIEW = '--full-quality' not in sys.argv
 
     W,H = 400,400
     root = tk.Tk('nekos.life viewer')
@@ -133,7 +352,7 @@ if __name__ == '__main__':
         nekoslife.ENDPOINT_TYPES,nekoslife.ENDPOINT_FORMATS,nekoslife.get_endpoints())
     category_chooser.grid(row=0)
 
-    image_display = ImageDisplay(root)
+    image_display = ImageDisplay(root, nekoslife.get_thumbnail)
     image_display.update_resolution(W,H)
     image_display.grid(row=1)
 
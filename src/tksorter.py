@@ -6,45 +6,274 @@ Use it if you want.
 You must enter keys and directories.
 With the first argument being the key and every other argument in pairs,
 where the firt arg is the key symbol and the second a save directory.
+BackSpace undoes the last decisions.
+With --thumbnails, thumbnails are made while downloading and shown instead of the full images.
 """
 import sys,os
+import json
+import shutil
+import threading
+import time
 import tkinter as tk
+from collections import deque
 from pprint import pprint
 from nekoslife_dl import NekosLifeScroller
-from tkscroller import ImageDisplay,CategoryChooser
+from tkscroller import ImageDisplay,CategoryChooser,THUMBNAIL_SIZES
+
+UNDO_KEYSYM = 'BackSpace'
+
+class SortJournal:
+    """
+    Sorting decisions, moved into place by a background thread so key presses never wait for the disk.
+    Every decision is appended to the journal file first and then applied in batches.
+    Decisions that weren't applied before the sorter closed are applied the next time.
+    The last `UNDO` decisions can be undone, trashed images are kept in `trash_folder` until then.
+    Undoing is also done by the background thread, `restored` is set on a decision once it's back.
+    """
+    UNDO = 20
+    BATCH_INTERVAL = 0.2 # seconds decisions are gathered for before they're applied
+
+    def __init__(self, path, trash_folder):
+        self.path = path
+        self.trash_folder = trash_folder
+        self.pending = [] # decisions and {"undo": decision} waiting to be applied
+        self.history = deque() # decisions that can be undone, newest last
+        self.purge = [] # trashed decisions that can't be undone anymore
+        self.closed = False
+        self._counter = 0
+        self._condition = threading.Condition()
+        self._apply_lock = threading.Lock() # held while files are moved
+        self._write_lock = threading.Lock()
+
+        self.replay()
+        self.thread = threading.Thread(target=self._worker, name='nlsorter', daemon=True)
+        self.thread.start()
+
+    def _write(self, *entries):
+        with self._write_lock, open(self.path, 'a') as file:
+            file.writelines(json.dumps(entry)+'\n' for entry in entries)
+
+    def replay(self):
+        """
+        Queues decisions the last session didn't apply and deletes images it trashed.
+        Then starts the journal over.
+        """
+        if not os.path.isfile(self.path):
+            return
+        decisions = {}
+        with open(self.path) as file:
+            for line in file:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue # cut off when the sorter was killed
+                if 'source' in entry:
+                    decisions[entry['id']] = entry
+                elif entry.get('undo') in decisions:
+                    del decisions[entry['undo']]
+                elif entry.get('applied') in decisions:
+                    decisions[entry['applied']]['applied'] = True
+
+        self.purge = [i for i in decisions.values() if i['applied'] and i['trash']]
+        self.pending = [i for i in decisions.values()
+                        if not i['applied'] and os.path.isfile(i['source'])]
+        self._counter = max(decisions, default=-1)+1
+        os.remove(self.path)
+        self._write(*self.pending)
+
+    def decide(self, source, target=None):
+        """
+        Moves `source` into `target`, or into the trash if it's None.
+        Returns right away, the file is moved later.
+        """
+        filename = os.path.split(source)[1]
+        decision = {'id': self._counter, 'source': source, 'trash': target is None,
+                    'target': target or os.path.join(self.trash_folder, filename),
+                    'applied': False, 'restored': False}
+        self._counter += 1
+        self._write(decision)
+        with self._condition:
+            self.pending.append(decision)
+            self.history.append(decision)
+            while len(self.history) > self.UNDO:
+                old = self.history.popleft()
+                if old['trash']:
+                    self.purge.append(old)
+            self._condition.notify()
+
+    def undo(self):
+        """
+        Undoes the last decision and returns it, None if there's nothing to undo.
+        Returns right away, a decision that was already applied is moved back later. \
+        Its file is back at `decision['source']` once `decision['restored']` is True.
+        """
+        with self._condition:
+            if not self.history:
+                return None
+            decision = self.history.pop()
+            for i, item in enumerate(self.pending):
+                if item is decision:
+                    # never moved, just forget it
+                    del self.pending[i]
+                    decision['restored'] = True
+                    break
+            else:
+                self.pending.append({'undo': decision})
+                self._condition.notify()
+                return decision
+        self._write({'undo': decision['id']})
+        return decision
+
+    @staticmethod
+    def move(source, target):
+        """
+        Moves a file, also onto other filesystems, making the directories it needs.
+        """
+        os.makedirs(os.path.dirname(target) or '.', exist_ok=True)
+        shutil.move(source, target)
+
+    def flush(self):
+        """
+        Applies all pending decisions now.
+        """
+        with self._apply_lock:
+            with self._condition:
+                batch, self.pending = self.pending, []
+            entries = []
+            for item in batch:
+                if 'undo' in item:
+                    decision = item['undo']
+                    if not decision.get('failed'):
+                        self._try_move(decision['target'], decision['source'])
+                    decision['restored'] = True
+                    entries.append({'undo': decision['id']})
+                else:
+                    item['failed'] = not self._try_move(item['source'], item['target'])
+                    item['applied'] = True
+                    entries.append({'applied': item['id']})
+
+            with self._condition:
+                purge = [i for i in self.purge if i['applied']]
+                self.purge = [i for i in self.purge if not i['applied']]
+            for decision in purge:
+                if not decision.get('failed') and os.path.isfile(decision['target']):
+                    os.remove(decision['target'])
+
+            if entries:
+                self._write(*entries)
+
+    def flush_in_background(self):
+        """
+        Same as `flush`, but returns right away.
+        Returns a `threading.Event` that's set once everything pending until now is applied.
+        """
+        flushed = threading.Event()
+        def flush():
+            self.flush()
+            flushed.set()
+
+        threading.Thread(target=flush, name='nlsorterflush', daemon=True).start()
+        return flushed
+
+    def _try_move(self, source, target):
+        try:
+            self.move(source, target)
+        except OSError as e:
+            print(f'\nCould not move {source} to {target}: {e}')
+            return False
+        return True
+
+    def _worker(self):
+        while True:
+            with self._condition:
+                self._condition.wait_for(lambda: self.pending or self.purge or self.closed)
+                if self.closed:
+                    return
+            time.sleep(self.BATCH_INTERVAL)
+            self.flush()
+
+    def close(self):
+        """
+        Applies everything and deletes all trashed images, they can't be undone anymore.
+        """
+        with self._condition:
+            self.closed = True
+            self.purge += [i for i in self.history if i['trash']]
+            self.history.clear()
+            self._condition.notify()
+        self.thread.join()
+        self.flush()
+        if os.path.isfile(self.path):
+            os.remove(self.path)
 
 def update_display(imagedata):
     image_display.update_resolution(root.winfo_width(),root.winfo_height())
     image_display.update_display(*imagedata)
+    image_display.preload(nekoslife.peek_next_images(image_display.PRELOAD))
     
 def new_session():
     nekoslife.new_session(category_chooser.get_category())
     update_display(nekoslife.get_current_image())
 
-def reset_session():
+def reset_session(flushed=None):
+    """
+    Resets the session once the journal moved every sorted image, \
+    the session deletes every image in the save folder.
+    """
+    if flushed is None or flushed.is_set() and journal.pending:
+        flushed = journal.flush_in_background()
+    if not flushed.is_set():
+        root.after(50,reset_session,flushed)
+        return
     nekoslife.reset_session(category_chooser.get_category())
     update_display(nekoslife.get_current_image())
 
 
+def show_restored(decision):
+    """
+    Shows an undone image once the journal moved it back.
+    """
+    if not decision['restored']:
+        root.after(50,show_restored,decision)
+        return
+    path = decision['source']
+    filename = os.path.split(path)[1]
+    if not os.path.isfile(path):
+        print(f'Could not put back {filename}.')
+        return # moving it back failed, the journal said why
+    nekoslife.add_downloaded(filename)
+    nekoslife.current_image,nekoslife.current_filename = path,filename
+    update_display(nekoslife.get_current_image())
+
 def key_pressed(event):
     keysym = event.keysym
     print(f'Pressed "{keysym}"',end='')
     
+    if keysym == UNDO_KEYSYM:
+        decision = journal.undo()
+        if decision is None:
+            print(', nothing to undo.')
+            return
+        print(f', putting back {os.path.split(decision["source"])[1]}.')
+        show_restored(decision)
+        return
+
+    filename = os.path.split(nekoslife.current_image)[1]
     if keysym == trash_keysym:
         print(', deleting file.')
-        remove = True
+        path = None
     elif keysym not in paths:
         print(', no behaviour set.')
         return
     else:
-        old_path = os.path.realpath(nekoslife.current_image)
-        filename = os.path.split(nekoslife.current_image)[1]
         path = os.path.realpath(os.path.join(paths[keysym],filename))
-        os.renames(old_path,path)
         print(f', moving to {path}.')
-        remove = False
 
-    update_display(nekoslife.get_next_image(remove=remove))
+    journal.decide(os.path.realpath(nekoslife.current_image),path)
+    nekoslife.remove_downloaded(filename)
+    if nekoslife.thumbnails is not None:
+        nekoslife.thumbnails.remove(filename)
+    update_display(nekoslife.get_next_image(remove=False))
 
 def update_loaded():
     category_chooser.loaded.configure(text=f'\tloaded images: {len(nekoslife.listdir())}')
@@ -53,14 +282,18 @@ def update_loaded():
 if __name__ == '__main__':
     print('INITIALIZING')
     
-    if len(sys.argv) < 2:
+    argv = [i for i in sys.argv if i != '--thumbnails']
+    if len(argv) < 2:
         raise ValueError('You must enter a trash keysym. Reffer to documentation.')
     
-    trash_keysym = sys.argv[1]
-    paths = {sys.argv[i]:sys.argv[i+1] for i in range(2,len(sys.argv)-1,2)}
+    trash_keysym = argv[1]
+    paths = {argv[i]:argv[i+1] for i in range(2,len(argv)-1,2)}
     pprint(paths)
     
-    nekoslife = NekosLifeScroller(download_threads=3)
+    nekoslife = NekosLifeScroller(download_threads=3,
+        thumbnail_sizes=THUMBNAIL_SIZES if '--thumbnails' in sys.argv else None)
+    folder = os.path.normpath(nekoslife.save_folder)
+    journal = SortJournal(folder+'.journal', folder+'.trash')
 
     W,H = 400,400
     root = tk.Tk('nekos.life sorter')
@@ -70,7 +303,7 @@ if __name__ == '__main__':
         nekoslife.ENDPOINT_TYPES,nekoslife.ENDPOINT_FORMATS,nekoslife.get_endpoints())
     category_chooser.grid(row=0)
 
-    image_display = ImageDisplay(root)
+    image_display = ImageDisplay(root, nekoslife.get_thumbnail)
     image_display.update_resolution(W,H)
     image_display.grid(row=1)
 
@@ -79,4 +312,5 @@ if __name__ == '__main__':
     update_loaded()
 
     root.bind('<Key>',key_pressed)
-    root.mainloop()
\ No newline at end of file
+    root.mainloop()
+    journal.close()
\ No newline at end of file